@@ -0,0 +1,211 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+from event_journal import JOURNAL_TIME_FORMAT
+from reservation_store import TIME_FORMAT, is_valid
+from room_views import day_bounds, operating_hours
+
+GROUP_COLUMNS = {'Equipment': 'Equipments', 'Room': 'Room', 'User': 'Name'}
+LOGGED_FIELDS = ['Name', 'Room', 'Equipments', 'Start_Time', 'End_Time']
+JOURNAL_START = datetime.datetime(2000, 1, 1)
+
+
+# Split reservations into pieces of at most one clock hour with NumPy: every
+# reservation is repeated once per hour it touches and each piece is clipped
+# to its hour, giving (Room, Equipments, Name, Hour, Seconds) rows
+def hour_pieces(reservations):
+    starts = reservations['Start_Time'].to_numpy('datetime64[s]')
+    ends = reservations['End_Time'].to_numpy('datetime64[s]')
+    valid = ends > starts
+    first_hours = starts.astype('datetime64[h]')
+    counts = np.where(valid, (ends - np.timedelta64(1, 's')).astype('datetime64[h]') - first_hours + 1, 0)
+    counts = counts.astype(np.int64)
+    rows = np.repeat(np.arange(len(reservations)), counts)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    hours = (first_hours[rows] + offsets.astype('timedelta64[h]')).astype('datetime64[s]')
+    seconds = np.minimum(ends[rows], hours + np.timedelta64(1, 'h')) - np.maximum(starts[rows], hours)
+    return pd.DataFrame({
+        'Room': reservations['Room'].to_numpy()[rows],
+        'Equipments': reservations['Equipments'].to_numpy()[rows],
+        'Name': reservations['Name'].to_numpy()[rows],
+        'Hour': hours,
+        'Seconds': seconds.astype(np.float64)
+    })
+
+
+# Cancellations recorded in the change log before before ("Delete
+# Reservation" entries carry the cancelled reservation as printed by pandas),
+# with the time they happened. pandas cuts long values short with "...";
+# those entries are left out rather than counted on a made-up equipment.
+def load_cancellations(log_path, before=None):
+    columns = LOGGED_FIELDS + ['Cancelled_At']
+    if not os.path.exists(log_path):
+        return pd.DataFrame(columns=columns)
+    log = pd.read_csv(log_path, dtype=str)
+    log = log[log['action'] == 'Delete Reservation']
+    cancellations = pd.DataFrame({
+        field: log['details'].str.extract(rf'(?m)^(?:Details: )?{field}\s{{2,}}(.+?)\s*$', expand=False)
+        for field in LOGGED_FIELDS
+    })
+    truncated = cancellations.apply(lambda column: column.str.endswith('...')).any(axis=1)
+    cancellations = cancellations[~truncated]
+    cancellations['Start_Time'] = pd.to_datetime(cancellations['Start_Time'], errors='coerce')
+    cancellations['End_Time'] = pd.to_datetime(cancellations['End_Time'], errors='coerce')
+    cancellations['Cancelled_At'] = pd.to_datetime(log['timestamp'], errors='coerce')
+    if before is not None:
+        cancellations = cancellations[cancellations['Cancelled_At'] < before]
+    return cancellations.dropna().reset_index(drop=True)[columns]
+
+
+# Cancellations in the event journal up to now: every 'cancel' event, which
+# is what the rollups count as changes happen (own and admin deletes, batch
+# cancels, blackout collisions, waitlist promotions), with its time
+def journal_cancellations(journal, now=None):
+    events = journal.events_between(JOURNAL_START, now or datetime.datetime.now())
+    events = events[events['type'] == 'cancel']
+    cancellations = events[LOGGED_FIELDS].copy()
+    cancellations['Start_Time'] = pd.to_datetime(cancellations['Start_Time'], format=TIME_FORMAT, errors='coerce')
+    cancellations['End_Time'] = pd.to_datetime(cancellations['End_Time'], format=TIME_FORMAT, errors='coerce')
+    cancellations['Cancelled_At'] = pd.to_datetime(events['time'], format=JOURNAL_TIME_FORMAT)
+    return cancellations.dropna().reset_index(drop=True)
+
+
+# Time of the first journal event, from which on the journal is the record
+# of cancellations; None for an empty journal
+def journal_start(journal):
+    first = journal.changes(0, 1)['changes']
+    return datetime.datetime.strptime(first[0]['time'], JOURNAL_TIME_FORMAT) if first else None
+
+
+class UtilizationRollups:
+    # Daily rollups of the reservation history, kept in memory and updated
+    # from the store's change events so the dashboards never rescan the CSVs:
+    #   booked[day][(room, equipment, name, hour of day)] -> seconds booked
+    #   counts[day][(room, equipment, name)] -> reservations starting that day
+    #   cancelled[day][(room, equipment, name)] -> [cancellations, late ones]
+    # A cancellation is late (the no-show proxy) when it happens less than
+    # late_cutoff before the start or after it; deleting a reservation that
+    # already ended is cleanup, not a cancellation. Cancellations come from
+    # the event journal, and from the change log for the time before it.
+    def __init__(self, store, policy, journal, log_path, late_cutoff=datetime.timedelta(hours=2)):
+        self.store = store
+        self.policy = policy
+        self.late_cutoff = late_cutoff
+        self.booked = {}
+        self.counts = {}
+        self.cancelled = {}
+        with store.events_lock:
+            store.refresh()
+            self._add_reservations(store.frame(), 1)
+            started = journal_start(journal)
+            self._add_cancellations(load_cancellations(log_path, before=started))
+            if started is not None:
+                self._add_cancellations(journal_cancellations(journal))
+            store.subscribe(self._on_change)
+
+    def _add_reservations(self, reservations, sign):
+        if reservations.empty:
+            return
+        pieces = hour_pieces(reservations)
+        pieces['Day'] = pieces['Hour'].dt.date
+        pieces['Hour'] = pieces['Hour'].dt.hour
+        totals = pieces.groupby(['Day', 'Room', 'Equipments', 'Name', 'Hour'])['Seconds'].sum()
+        for (day, *key), seconds in totals.items():
+            cells = self.booked.setdefault(day, {})
+            cells[tuple(key)] = cells.get(tuple(key), 0.0) + sign * seconds
+            if abs(cells[tuple(key)]) < 1e-6:
+                del cells[tuple(key)]
+
+        starts = reservations.assign(Day=reservations['Start_Time'].dt.date)
+        for (day, *key), count in starts.groupby(['Day', 'Room', 'Equipments', 'Name']).size().items():
+            cells = self.counts.setdefault(day, {})
+            cells[tuple(key)] = cells.get(tuple(key), 0) + sign * count
+            if not cells[tuple(key)]:
+                del cells[tuple(key)]
+
+    def _add_cancellations(self, cancellations):
+        cancellations = cancellations[cancellations['Cancelled_At'] < cancellations['End_Time']]
+        late = cancellations['Cancelled_At'] >= cancellations['Start_Time'] - self.late_cutoff
+        cancellations = cancellations.assign(Day=cancellations['Start_Time'].dt.date, Late=late.astype(int))
+        totals = cancellations.groupby(['Day', 'Room', 'Equipments', 'Name'])['Late'].agg(['size', 'sum'])
+        for (day, *key), (count, late_count) in totals.iterrows():
+            cells = self.cancelled.setdefault(day, {})
+            total = cells.setdefault(tuple(key), [0, 0])
+            total[0] += count
+            total[1] += late_count
+
+    def _on_change(self, event, rid, record, previous):
+        if event == 'reload':
+            self.booked.clear()
+            self.counts.clear()
+            self._add_reservations(self.store.frame(), 1)
+            return
+        if previous is not None and is_valid(previous):
+            self._add_reservations(pd.DataFrame([previous]), -1)
+        if record is not None and is_valid(record):
+            self._add_reservations(pd.DataFrame([record]), 1)
+        if event == 'cancel' and is_valid(previous):
+            cancellation = {**previous, 'Cancelled_At': datetime.datetime.now()}
+            self._add_cancellations(pd.DataFrame([cancellation]))
+
+    # Rollup cells of the days in [first_day, last_day] as a DataFrame
+    def _rows(self, rollup, first_day, last_day, keys, values):
+        rows = []
+        day = first_day
+        with self.store.events_lock:
+            self.store.refresh()
+            while day <= last_day:
+                for key, value in rollup.get(day, {}).items():
+                    rows.append((day, *key, *(value if isinstance(value, list) else [value])))
+                day += datetime.timedelta(days=1)
+        return pd.DataFrame(rows, columns=['Day'] + keys + values).astype({value: np.float64 for value in values})
+
+    # Utilization per equipment, room or user between two days (inclusive):
+    # booked hours, reservations, cancellations, late cancellations and the
+    # cancellation rate. Equipments and rooms also get their busy fraction of
+    # the operating hours of the enabled equipments in the catalog.
+    def summary(self, group_by, first_day, last_day, catalog):
+        column = GROUP_COLUMNS[group_by]
+        keys = ['Room', 'Equipments', 'Name']
+        booked = self._rows(self.booked, first_day, last_day, keys + ['Hour'], ['Seconds'])
+        counts = self._rows(self.counts, first_day, last_day, keys, ['Reservations'])
+        cancelled = self._rows(self.cancelled, first_day, last_day, keys, ['Cancellations', 'Late_Cancellations'])
+
+        result = pd.concat([
+            booked.groupby(column)['Seconds'].sum().div(3600).rename('Booked_Hours'),
+            counts.groupby(column)['Reservations'].sum(),
+            cancelled.groupby(column)[['Cancellations', 'Late_Cancellations']].sum()
+        ], axis=1).fillna(0)
+        result[['Reservations', 'Cancellations', 'Late_Cancellations']] = \
+            result[['Reservations', 'Cancellations', 'Late_Cancellations']].astype(int)
+        made = result['Reservations'] + result['Cancellations']
+        result['Cancellation_Rate'] = (result['Cancellations'] / made.where(made > 0)).fillna(0)
+
+        if group_by != 'User':
+            days = (last_day - first_day).days + 1
+            capacity = {}
+            for room, equipments in catalog.items():
+                for equipment, info in equipments.items():
+                    if not info.get('enabled', False):
+                        continue
+                    starts, ends = day_bounds([first_day], operating_hours(self.policy, equipment))
+                    name = room if group_by == 'Room' else equipment
+                    capacity[name] = capacity.get(name, 0) + days * (ends[0] - starts[0]).astype(np.float64) / 3600
+            capacity = pd.Series(capacity, dtype=np.float64)
+            result = result.reindex(result.index.union(capacity.index), fill_value=0)
+            result['Utilization'] = (result['Booked_Hours'] / capacity.reindex(result.index)).clip(upper=1)
+        result.index.name = group_by
+        return result.sort_values('Booked_Hours', ascending=False)
+
+    # Booked hours by hour of day (rows) and weekday (columns), optionally for one room
+    def peak_hours(self, first_day, last_day, room=None):
+        booked = self._rows(self.booked, first_day, last_day, ['Room', 'Equipments', 'Name', 'Hour'], ['Seconds'])
+        if room is not None:
+            booked = booked[booked['Room'] == room]
+        booked['Weekday'] = pd.Categorical(pd.to_datetime(booked['Day']).dt.day_name().str[:3],
+                                           categories=['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
+        grid = booked.pivot_table(index='Hour', columns='Weekday', values='Seconds', aggfunc='sum', fill_value=0)
+        return grid.reindex(index=range(24), fill_value=0).div(3600)
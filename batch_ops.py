@@ -0,0 +1,139 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from bulk_import import add_reason, interval_arrays, overlap_flags
+from reservation_store import ID_COLUMN, RESERVATION_COLUMNS
+
+ACTIONS = ('cancel', 'move', 'reassign')
+NEW_COLUMNS = ['New_' + column for column in RESERVATION_COLUMNS]
+PLAN_COLUMNS = [ID_COLUMN] + RESERVATION_COLUMNS + NEW_COLUMNS + ['Reason']
+# Booking rules left out when checking moved reservations: they compare with
+# the other reservations, where the moved ones still sit at their old times
+# (overlaps are checked here with the batch taken into account)
+MOVE_SKIPPED_RULES = {'no_overlap', 'no_back_to_back', 'max_hours_per_week'}
+
+
+# Reservations matching every filter given (room, equipment, days from
+# first_day to last_day inclusive, user name), ordered by start time
+def select_reservations(store, room=None, equipment=None, first_day=None, last_day=None, name=None):
+    start_time = datetime.datetime.combine(first_day, datetime.time(0, 0)) if first_day else None
+    end_time = (datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time(0, 0))
+                if last_day else None)
+    df = store.frame(start_time, end_time, room=room)
+    if equipment:
+        df = df[df['Equipments'] == equipment]
+    if name:
+        df = df[df['Name'] == name]
+    return df.sort_values('Start_Time', ignore_index=True)
+
+
+# Preview of a batch over the reservation IDs: one row per reservation with
+# its values before and after (New_* stay empty for a cancellation) and a
+# Reason that stays empty while the row can be applied. A move goes to
+# another room / equipment and/or shifts by a timedelta; the moved
+# reservations leave their old times free for each other, and must not
+# overlap one another, any other reservation or a blackout. With a catalog
+# (equipment_details.json) the target equipment must exist and be enabled,
+# and with a policy the moved times must pass the booking rules for role
+# (not in the past, within the fixed slots...). With a reservation service
+# the service's own policy is used.
+def plan_batch(store, rids, action, room=None, equipment=None, shift=None, name=None, catalog=None, policy=None,
+               role=None):
+    if store.remote:
+        return store.call('bookings', 'plan_batch', rids, action, room, equipment, shift, name, catalog, role)
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown batch action: {action}")
+    with store.lock:
+        # Plan against what is on disk now, not what this process saw last
+        store.refresh()
+        records = [store.get(rid) for rid in rids]
+        plan = pd.DataFrame([{**{column: record[column] for column in RESERVATION_COLUMNS}, ID_COLUMN: rid}
+                             if record is not None and ID_COLUMN in record else {ID_COLUMN: rid}
+                             for rid, record in zip(rids, records)], columns=PLAN_COLUMNS)
+        plan['Start_Time'] = pd.to_datetime(plan['Start_Time'])
+        plan['End_Time'] = pd.to_datetime(plan['End_Time'])
+        plan['Reason'] = ''
+        add_reason(plan, plan['Name'].isna(), "Reservation no longer exists")
+        if action == 'cancel':
+            return plan
+
+        for column in RESERVATION_COLUMNS:
+            plan['New_' + column] = plan[column]
+        if action == 'reassign':
+            plan['New_Name'] = name
+            return plan
+
+        if room:
+            plan['New_Room'] = room
+        if equipment:
+            plan['New_Equipments'] = equipment
+        if shift:
+            plan['New_Start_Time'] = plan['Start_Time'] + shift
+            plan['New_End_Time'] = plan['End_Time'] + shift
+        if catalog is not None:
+            targets = [catalog.get(row.New_Room, {}).get(row.New_Equipments)
+                       for row in plan[['New_Room', 'New_Equipments']].itertuples()]
+            exists = plan['Name'].notna().to_numpy()
+            add_reason(plan, exists & np.array([target is None for target in targets]),
+                       "Unknown equipment for this room")
+            add_reason(plan, exists & np.array([target is not None and not target.get('enabled', False)
+                                                for target in targets]), "Equipment is disabled")
+
+        movable = plan[plan['Reason'] == '']
+        if movable.empty:
+            return plan
+        moved = pd.DataFrame({column: movable['New_' + column].to_numpy() for column in RESERVATION_COLUMNS},
+                             index=movable.index)
+        moved['Start_Time'] = pd.to_datetime(moved['Start_Time'])
+        moved['End_Time'] = pd.to_datetime(moved['End_Time'])
+        keys, starts, ends = interval_arrays(moved)
+        overlapping = overlap_flags(keys, starts, ends, np.ones(len(moved), dtype=bool))
+        add_reason(plan, plan.index.isin(movable.index[overlapping]), "Overlaps another moved reservation")
+
+        in_batch = set(rids)
+        found = store.find_conflicts([(row.Room, row.Equipments, row.Start_Time.to_pydatetime(),
+                                       row.End_Time.to_pydatetime()) for row in moved.itertuples()])
+        blocked = [index for index, conflicts in zip(moved.index, found)
+                   if [rid for rid in conflicts if rid not in in_batch]]
+        add_reason(plan, plan.index.isin(blocked), "Overlaps an existing reservation or blackout")
+
+        if policy is not None:
+            candidates = [{**row, 'Start_Time': row['Start_Time'].to_pydatetime(),
+                           'End_Time': row['End_Time'].to_pydatetime()} for row in moved.to_dict('records')]
+            for index, violations in zip(moved.index, policy.check(store, role, candidates,
+                                                                   skip=MOVE_SKIPPED_RULES)):
+                if violations:
+                    add_reason(plan, plan.index == index, ' '.join(violations))
+    return plan
+
+
+# Apply a batch as one store commit (a single write per touched file). The
+# plan is rebuilt under the store lock first; if any row has a Reason,
+# nothing is applied. Returns the number of changed reservations and the plan.
+def apply_batch(store, rids, action, room=None, equipment=None, shift=None, name=None, catalog=None, policy=None,
+                role=None):
+    # A reservation service plans and applies the batch under its own lock
+    if store.remote:
+        changed, plan = store.call('bookings', 'apply_batch', rids, action, room, equipment, shift, name, catalog,
+                                   role)
+        return changed, plan
+    with store.lock:
+        plan = plan_batch(store, rids, action, room, equipment, shift, name, catalog, policy, role)
+        if plan.empty or (plan['Reason'] != '').any():
+            return 0, plan
+        if action == 'cancel':
+            store.commit(cancels=list(plan[ID_COLUMN]))
+        else:
+            updates = {}
+            for row in plan.to_dict('records'):
+                changes = {column: row['New_' + column] for column in RESERVATION_COLUMNS
+                           if row['New_' + column] != row[column]}
+                for column in ('Start_Time', 'End_Time'):
+                    if column in changes:
+                        changes[column] = pd.Timestamp(changes[column]).to_pydatetime()
+                if changes:
+                    updates[row[ID_COLUMN]] = changes
+            store.commit(updates=updates)
+        return len(plan), plan
@@ -0,0 +1,199 @@
+import datetime
+
+from quotas import week_pieces
+
+
+def check_start_before_end(rule, candidate, store, now):
+    if candidate['Start_Time'] >= candidate['End_Time']:
+        return "The start time must be before the end time. Please adjust your selection."
+
+
+def check_not_in_past(rule, candidate, store, now):
+    if candidate[rule.get('field', 'Start_Time')] < now:
+        return "Cannot book a reservation in the past. Please select a future time."
+
+
+def check_max_days_advance(rule, candidate, store, now):
+    if (candidate['Start_Time'].date() - now.date()).days > rule['days']:
+        return f"{candidate['Equipments']} can only be booked up to {rule['days']} day(s) in advance."
+
+
+# Slot template of a fixed_slots rule as (start, end) times of day
+def parse_slots(rule):
+    return [(datetime.time.fromisoformat(start), datetime.time.fromisoformat(end)) for start, end in rule['slots']]
+
+
+def check_fixed_slots(rule, candidate, store, now):
+    start, end = candidate['Start_Time'], candidate['End_Time']
+    if start.date() != end.date() or (start.time(), end.time()) not in parse_slots(rule):
+        return f"{candidate['Equipments']} can only be booked in its predefined time slots."
+
+
+# Blackouts share the interval index with reservations, so the same lookup finds both
+def check_no_overlap(rule, candidate, store, now):
+    found = store.conflicts(candidate['Room'], candidate['Equipments'], candidate['Start_Time'], candidate['End_Time'])
+    for rid in found:
+        blackout = store.get(rid)
+        if blackout is not None and 'Blackout_ID' in blackout:
+            return (f"{candidate['Equipments']} is closed at that time ({blackout['Reason']}). "
+                    f"Please choose another time.")
+    if found:
+        return "This time slot is already reserved. Please choose another time."
+
+
+# The same user may not take the slot right before or after one they already hold
+def check_no_back_to_back(rule, candidate, store, now):
+    second = datetime.timedelta(seconds=1)
+    touching = store.conflicts(candidate['Room'], candidate['Equipments'],
+                               candidate['Start_Time'] - second, candidate['End_Time'] + second)
+    for rid in touching:
+        reservation = store.get(rid)
+        if reservation.get('Name') == candidate['Name'] and (reservation['End_Time'] == candidate['Start_Time']
+                                                         or reservation['Start_Time'] == candidate['End_Time']):
+            return "Cannot book continuous slots. Please select a non-continuous slot."
+
+
+# Hours the user already holds in a week on the rule's equipment class, from
+# the quota ledger when there is one or else from the user's reservations
+def booked_hours(rule, name, week, store, ledger):
+    if ledger is not None:
+        return ledger.booked(name, week, rule.get('equipment'))
+    return sum(hours for reservation in store.for_user(name)
+               if rule.get('equipment') is None or rule['equipment'] in reservation['Equipments']
+               for piece_week, hours in week_pieces(reservation['Start_Time'], reservation['End_Time'])
+               if piece_week == week)
+
+
+# pending holds the hours booked per (name, week, equipment class) including
+# the candidates accepted earlier in the same check, so a series cannot go
+# over the quota one occurrence at a time
+def check_max_hours_per_week(rule, candidate, store, now, ledger, pending):
+    for week, hours in week_pieces(candidate['Start_Time'], candidate['End_Time']):
+        key = (candidate['Name'], week, rule.get('equipment'))
+        if key not in pending:
+            pending[key] = booked_hours(rule, candidate['Name'], week, store, ledger)
+        if pending[key] + hours > rule['hours'] + 1e-9:
+            what = f"{rule['equipment']} equipment" if rule.get('equipment') else "equipment"
+            return (f"You can book at most {rule['hours']:g} hours of {what} per week "
+                    f"({pending[key]:g} booked in the week of {week.strftime('%Y/%m/%d')}).")
+
+
+RULE_CHECKS = {
+    'start_before_end': check_start_before_end,
+    'not_in_past': check_not_in_past,
+    'max_days_advance': check_max_days_advance,
+    'fixed_slots': check_fixed_slots,
+    'no_overlap': check_no_overlap,
+    'no_back_to_back': check_no_back_to_back
+}
+# Rules checked against the hours a user holds rather than one booking
+QUOTA_CHECKS = {
+    'max_hours_per_week': check_max_hours_per_week
+}
+
+
+# A rule applies to a booking when its equipment class (a substring of the
+# equipment name, like "PCR" or "Autoclave") and its roles both match
+def rule_matches(rule, role, equipment):
+    return (rule.get('equipment') is None or rule['equipment'] in equipment) and \
+        (rule.get('roles') is None or role in rule['roles'])
+
+
+def rule_specificity(rule):
+    return rule.get('equipment') is not None, rule.get('roles') is not None
+
+
+class BookingPolicy:
+    # rules is the list from booking_rules.json. For every rule name the most
+    # specific matching entry wins (equipment + role, then equipment, then
+    # role, then the default; later entries win ties), and "enabled": false
+    # switches a rule off. The winners per (role, equipment) are resolved once.
+    # Quotas read the hours already booked from ledger (a QuotaLedger).
+    def __init__(self, rules, ledger=None):
+        unknown = {rule['rule'] for rule in rules} - set(RULE_CHECKS) - set(QUOTA_CHECKS)
+        if unknown:
+            raise ValueError(f"Unknown booking rule(s): {', '.join(sorted(unknown))}")
+        self.rules = list(rules)
+        self.ledger = ledger
+        self._compiled = {}
+
+    def rules_for(self, role, equipment):
+        key = (role, equipment)
+        if key not in self._compiled:
+            winners = {}
+            for position, rule in enumerate(self.rules):
+                if rule_matches(rule, role, equipment):
+                    rank = rule_specificity(rule) + (position,)
+                    if rule['rule'] not in winners or rank > winners[rule['rule']][0]:
+                        winners[rule['rule']] = (rank, rule)
+            self._compiled[key] = [rule for _, rule in sorted(winners.values(), key=lambda item: item[0][-1])
+                                   if rule.get('enabled', True)]
+        return self._compiled[key]
+
+    # Furthest day ahead this role may book this equipment, for the date pickers
+    def max_days_advance(self, role, equipment, default=60):
+        for rule in self.rules_for(role, equipment):
+            if rule['rule'] == 'max_days_advance':
+                return rule['days']
+        return default
+
+    # Slot template of this equipment as (start, end) times of day, or None
+    # when it can be booked at any time
+    def slot_template(self, role, equipment):
+        for rule in self.rules_for(role, equipment):
+            if rule['rule'] == 'fixed_slots':
+                return parse_slots(rule)
+        return None
+
+    # The weekly hours quota of this role on this equipment, or None
+    def quota_rule(self, role, equipment):
+        for rule in self.rules_for(role, equipment):
+            if rule['rule'] == 'max_hours_per_week':
+                return rule
+        return None
+
+    # Check candidate bookings (dicts with the reservation columns) under one
+    # store lock and return every violation message for each candidate. Rules
+    # named in skip are left out. With a reservation service the service
+    # checks them against its own rules and store.
+    def check(self, store, role, candidates, now=None, skip=()):
+        if store.remote:
+            return store.call('bookings', 'check', role, candidates, now, sorted(skip))
+        now = now or datetime.datetime.now()
+        results = []
+        pending = {}
+        with store.lock:
+            store.refresh()
+            for candidate in candidates:
+                violations = []
+                quotas = []
+                for rule in self.rules_for(role, candidate['Equipments']):
+                    if rule['rule'] in skip:
+                        continue
+                    if rule['rule'] in QUOTA_CHECKS:
+                        quotas.append(rule)
+                        message = QUOTA_CHECKS[rule['rule']](rule, candidate, store, now, self.ledger, pending)
+                    else:
+                        message = RULE_CHECKS[rule['rule']](rule, candidate, store, now)
+                    if message:
+                        violations.append(rule.get('message', message))
+                # Only an accepted candidate counts towards the quota of the next ones
+                if not violations:
+                    for rule in quotas:
+                        for week, hours in week_pieces(candidate['Start_Time'], candidate['End_Time']):
+                            pending[(candidate['Name'], week, rule.get('equipment'))] += hours
+                results.append(violations)
+        return results
+
+    # Check the candidates and book them all in one store commit under the
+    # same lock, or book nothing when any breaks a rule. Returns the new IDs
+    # and the violations per candidate.
+    def book(self, store, role, candidates, now=None, skip=()):
+        if store.remote:
+            rids, violations = store.call('bookings', 'book', role, candidates, now, sorted(skip))
+            return rids, violations
+        with store.lock:
+            violations = self.check(store, role, candidates, now, skip)
+            if any(violations):
+                return [], violations
+            return store.add_many(candidates), violations
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+from reservation_store import RESERVATION_COLUMNS, TIME_FORMAT
+
+REPORT_COLUMNS = ['Row'] + RESERVATION_COLUMNS + ['Reason']
+
+
+# Parse time strings in the storage format, falling back to anything pandas understands
+def parse_times(values):
+    parsed = pd.to_datetime(values, format=TIME_FORMAT, errors='coerce')
+    missing = parsed.isna() & values.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(values[missing], errors='coerce')
+    return parsed
+
+
+# Read an uploaded file (or its rows already read as strings) into the typed
+# reservation schema. Every row keeps its position in the upload (Row,
+# 1-based) and a Reason that stays empty while the row is acceptable.
+def parse_upload(uploaded):
+    raw = uploaded if isinstance(uploaded, pd.DataFrame) else pd.read_csv(uploaded, dtype=str)
+    missing_columns = [column for column in RESERVATION_COLUMNS if column not in raw.columns]
+    if missing_columns:
+        raise ValueError(f"Missing column(s): {', '.join(missing_columns)}")
+
+    df = pd.DataFrame({'Row': np.arange(1, len(raw) + 1)})
+    for column in ['Name', 'Room', 'Equipments']:
+        df[column] = raw[column].str.strip()
+    df['Start_Time'] = parse_times(raw['Start_Time'])
+    df['End_Time'] = parse_times(raw['End_Time'])
+    df['Reason'] = ''
+
+    add_reason(df, df[['Name', 'Room', 'Equipments']].isna().any(axis=1), "Missing name, room or equipment")
+    add_reason(df, df['Start_Time'].isna() | df['End_Time'].isna(), "Unreadable start or end time")
+    add_reason(df, df['Start_Time'] >= df['End_Time'], "Start time is not before end time")
+    return df
+
+
+def add_reason(df, mask, reason):
+    mask = mask.to_numpy() if isinstance(mask, pd.Series) else mask
+    df.loc[mask, 'Reason'] = np.where(df.loc[mask, 'Reason'] == '', reason,
+                                      df.loc[mask, 'Reason'] + '; ' + reason)
+
+
+# Reject rooms and equipment that are not in equipment_details.json
+def check_catalog(df, catalog):
+    known_rooms = df['Room'].isin(list(catalog))
+    known_pairs = pd.MultiIndex.from_frame(df[['Room', 'Equipments']]).isin(
+        [(room, equipment) for room, equipments in catalog.items() for equipment in equipments])
+    add_reason(df, ~known_rooms, "Unknown room")
+    add_reason(df, known_rooms & ~known_pairs, "Unknown equipment for this room")
+
+
+# Sweep over intervals sorted by (equipment, start): a row overlaps an obstacle
+# either before it (the running maximum end of earlier obstacles passes its
+# start) or after it (the next obstacle starts before it ends). One sort,
+# so O(n log n) overall instead of one scan per row.
+def overlap_flags(keys, starts, ends, obstacle):
+    order = np.lexsort((starts, keys))
+    groups = pd.Series(keys[order])
+    sorted_starts = starts[order]
+    sorted_ends = ends[order]
+
+    obstacle_ends = pd.Series(np.where(obstacle[order], sorted_ends, -np.inf))
+    previous_end = obstacle_ends.groupby(groups).cummax().groupby(groups).shift(1).fillna(-np.inf)
+
+    obstacle_starts = pd.Series(np.where(obstacle[order], sorted_starts, np.nan))
+    next_start = obstacle_starts.groupby(groups).bfill().groupby(groups).shift(-1).fillna(np.inf)
+
+    flags = np.empty(len(order), dtype=bool)
+    flags[order] = (previous_end.to_numpy() > sorted_starts) | (next_start.to_numpy() < sorted_ends)
+    return flags
+
+
+def interval_arrays(df):
+    keys = pd.factorize(df['Room'] + '\x1f' + df['Equipments'])[0]
+    starts = df['Start_Time'].to_numpy('datetime64[s]').astype(np.float64)
+    ends = df['End_Time'].to_numpy('datetime64[s]').astype(np.float64)
+    return keys, starts, ends
+
+
+# Flag rows overlapping each other inside the upload, then rows overlapping
+# reservations that are already booked
+def check_conflicts(df, existing):
+    candidates = df[df['Reason'] == '']
+    if candidates.empty:
+        return
+
+    keys, starts, ends = interval_arrays(candidates)
+    within_upload = overlap_flags(keys, starts, ends, np.ones(len(candidates), dtype=bool))
+    add_reason(df, df.index.isin(candidates.index[within_upload]), "Overlaps another row in this upload")
+
+    combined = pd.concat([candidates[RESERVATION_COLUMNS], existing[RESERVATION_COLUMNS]], ignore_index=True)
+    keys, starts, ends = interval_arrays(combined)
+    is_existing = np.arange(len(combined)) >= len(candidates)
+    against_existing = overlap_flags(keys, starts, ends, is_existing)[:len(candidates)]
+    add_reason(df, df.index.isin(candidates.index[against_existing]), "Overlaps an existing reservation")
+
+
+# Flag rows falling in a blackout of their equipment or room; the
+# blackouts are not part of store.frame(), so ask the store's interval index
+def check_blackouts(df, store):
+    candidates = df[df['Reason'] == '']
+    blackout_ids = {record['Blackout_ID'] for record in store.blackouts()}
+    if candidates.empty or not blackout_ids:
+        return
+    found = store.find_conflicts([(row.Room, row.Equipments, row.Start_Time.to_pydatetime(),
+                                   row.End_Time.to_pydatetime()) for row in candidates.itertuples()])
+    blocked = np.array([bool(blackout_ids.intersection(ids)) for ids in found])
+    add_reason(df, df.index.isin(candidates.index[blocked]), "Falls in a blackout")
+
+
+# Validate an uploaded schedule and merge the accepted rows into the store in
+# one write. With all_or_nothing, any rejected row blocks the whole import.
+# Returns the new reservation IDs and the per-row rejection report.
+def import_reservations(store, uploaded, catalog, all_or_nothing=True):
+    # A reservation service validates and merges the upload under its own lock
+    if store.remote:
+        rids, report = store.call('bookings', 'import_reservations', pd.read_csv(uploaded, dtype=str), catalog, all_or_nothing)
+        return rids, report
+    df = parse_upload(uploaded)
+    check_catalog(df, catalog)
+
+    with store.lock:
+        check_conflicts(df, store.frame())
+        check_blackouts(df, store)
+        rejected = df['Reason'] != ''
+        report = df.loc[rejected, REPORT_COLUMNS].reset_index(drop=True)
+        if all_or_nothing and rejected.any():
+            return [], report
+
+        accepted = df.loc[~rejected, RESERVATION_COLUMNS].to_dict('records')
+        for reservation in accepted:
+            reservation['Start_Time'] = reservation['Start_Time'].to_pydatetime()
+            reservation['End_Time'] = reservation['End_Time'].to_pydatetime()
+        rids = store.add_many(accepted) if accepted else []
+    return rids, report
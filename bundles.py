@@ -0,0 +1,67 @@
+import datetime
+
+
+# Legs of the same bundle that would overlap each other on one piece of equipment
+def clashing_legs(legs):
+    clashes = set()
+    for i, leg in enumerate(legs):
+        for j in range(i + 1, len(legs)):
+            other = legs[j]
+            if ((leg['Room'], leg['Equipments']) == (other['Room'], other['Equipments'])
+                    and leg['Start_Time'] < other['End_Time'] and other['Start_Time'] < leg['End_Time']):
+                clashes.update((i, j))
+    return clashes
+
+
+def shift_legs(legs, delta):
+    return [{**leg, 'Start_Time': leg['Start_Time'] + delta, 'End_Time': leg['End_Time'] + delta} for leg in legs]
+
+
+# Earliest shift of the whole bundle that makes every leg free. Each round
+# moves the bundle just past the latest-ending reservation blocking any leg,
+# so the search only visits conflict boundaries. Returns None when nothing
+# fits within max_shift, or when the first free shift breaks a booking rule.
+def suggest_shift(store, legs, max_shift=datetime.timedelta(days=7), policy=None, role=None):
+    delta = datetime.timedelta(0)
+    with store.lock:
+        while delta <= max_shift:
+            shifted = shift_legs(legs, delta)
+            found = store.find_conflicts(
+                [(leg['Room'], leg['Equipments'], leg['Start_Time'], leg['End_Time']) for leg in shifted])
+            step = datetime.timedelta(0)
+            for leg, conflicts in zip(shifted, found):
+                for rid in conflicts:
+                    step = max(step, store.get(rid)['End_Time'] - leg['Start_Time'])
+            if step == datetime.timedelta(0):
+                if policy is not None and any(policy.check(store, role, shifted)):
+                    return None
+                return delta
+            delta += step
+    return None
+
+
+# Book several (equipment, interval) legs as one unit. Every leg is checked
+# in one pass under the store lock, against the booking policy when one is
+# given or else only against the interval index, and the bundle is written
+# with a single add_many, so either all legs are booked or none. Returns the
+# new IDs and the problems of each leg (violation messages, or conflicting
+# IDs without a policy). When nothing was booked and only conflicts were in
+# the way, also returns one shift that would free the whole bundle (or None).
+def book_bundle(store, name, legs, max_shift=datetime.timedelta(days=7), policy=None, role=None):
+    if store.remote:
+        rids, problems, shift = store.call('bookings', 'book_bundle', name, legs, max_shift, role)
+        return rids, problems, shift
+    legs = [{**leg, 'Name': name} for leg in legs]
+    if clashing_legs(legs):
+        raise ValueError("Two steps of the bundle use the same equipment at the same time.")
+
+    with store.lock:
+        found = store.find_conflicts(
+            [(leg['Room'], leg['Equipments'], leg['Start_Time'], leg['End_Time']) for leg in legs])
+        problems = policy.check(store, role, legs) if policy is not None else found
+        if any(problems):
+            # Only a bundle held back by other reservations alone can be moved
+            shiftable = any(found) and (policy is None or not any(policy.check(store, role, legs,
+                                                                               skip={'no_overlap'})))
+            return [], problems, suggest_shift(store, legs, max_shift, policy, role) if shiftable else None
+        return store.add_many(legs), problems, None
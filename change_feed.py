@@ -0,0 +1,30 @@
+import argparse
+import json
+
+from event_journal import list_snapshots, read_changes
+from tenants import Tenants
+
+JOURNAL_FILE_PATH = 'reservation_events.jsonl'
+JOURNAL_SNAPSHOT_DIR = 'journal_snapshots'
+TENANTS_FILE_PATH = 'tenants.json'
+
+
+# Print one page of reservation changes after a cursor as JSON, for
+# consumers polling the feed from the command line or a cron job. Pass the
+# returned "cursor" back on the next poll; start from 0 for a full replay.
+def main():
+    parser = argparse.ArgumentParser(description="Reservation changes after a cursor")
+    parser.add_argument('cursor', nargs='?', type=int, default=0)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--journal', default=None, help="journal of the tenant by default")
+    parser.add_argument('--snapshots', default=None, help="snapshot folder of the tenant by default")
+    parser.add_argument('--tenant', help="Read the changes of this tenant of tenants.json")
+    args = parser.parse_args()
+    tenant = Tenants(TENANTS_FILE_PATH).from_args(parser, args.tenant)
+    journal_path = args.journal or tenant.path(JOURNAL_FILE_PATH)
+    snapshot_dir = args.snapshots or tenant.path(JOURNAL_SNAPSHOT_DIR)
+    print(json.dumps(read_changes(journal_path, list_snapshots(snapshot_dir), args.cursor, args.limit), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import bisect
+import datetime
+import json
+import os
+import threading
+
+import pandas as pd
+
+from reservation_store import ID_COLUMN, RESERVATION_COLUMNS, format_time
+
+JOURNAL_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+EVENT_COLUMNS = ['time', 'seq', 'type', 'actor', 'rid'] + RESERVATION_COLUMNS
+
+_actor = threading.local()
+
+
+# Name recorded as the author of the store changes made by this thread.
+# Streamlit runs every script rerun in its own thread, so app.py sets it
+# once per rerun from the logged in user.
+def set_actor(name):
+    _actor.name = name
+
+
+def current_actor():
+    return getattr(_actor, 'name', None)
+
+
+# Reservation as stored in the journal: plain strings, times in the CSV format
+def serialize(record):
+    if record is None:
+        return None
+    return {column: format_time(value) for column, value in record.items()}
+
+
+# Blackout events travel with the journal (so service clients get them) but
+# are not part of the reservation state
+def apply_event(state, event):
+    if event['type'] == 'blackout':
+        return
+    if event['type'] == 'reload':
+        state.clear()
+        state.update(event['records'])
+    elif event['type'] == 'cancel':
+        state.pop(event['rid'], None)
+    else:
+        state[event['rid']] = event['record']
+
+
+# Snapshots of a journal as (time, seq, path, journal offset), oldest first;
+# everything but the state itself is encoded in the file name. Older
+# <seq>-<time>.json snapshots keep their offset inside the file, which is
+# read once here.
+def list_snapshots(snapshot_dir):
+    snapshots = []
+    for file_name in os.listdir(snapshot_dir) if os.path.isdir(snapshot_dir) else []:
+        parts = file_name[:-len('.json')].split('-')
+        if not file_name.endswith('.json') or len(parts) not in (2, 3):
+            continue
+        path = os.path.join(snapshot_dir, file_name)
+        if len(parts) == 3:
+            offset = int(parts[2])
+        else:
+            with open(path, 'r') as f:
+                offset = json.load(f)['offset']
+        snapshots.append((datetime.datetime.strptime(parts[1], '%Y%m%d%H%M%S%f'), int(parts[0]), path, offset))
+    return sorted(snapshots)
+
+
+# One page of the change feed: the events after cursor (a journal seq), at
+# most limit of them. The nearest snapshot at or before the cursor gives the
+# journal offset to start reading from, so a poll only reads the events it
+# returns plus at most one snapshot interval. A reload event means the
+# consumer has to fetch the whole state again; its records are left out.
+def read_changes(path, snapshots, cursor, limit=100):
+    seqs = [snapshot[1] for snapshot in snapshots]
+    position = bisect.bisect_right(seqs, cursor)
+    offset = snapshots[position - 1][3] if position else 0
+    changes = []
+    has_more = False
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            f.seek(offset)
+            for line in f:
+                event = json.loads(line)
+                if event['seq'] <= cursor:
+                    continue
+                if len(changes) == limit:
+                    has_more = True
+                    break
+                event.pop('records', None)
+                changes.append(event)
+    return {'cursor': changes[-1]['seq'] if changes else cursor, 'changes': changes, 'has_more': has_more}
+
+
+def state_frame(state):
+    return pd.DataFrame(list(state.values()), columns=RESERVATION_COLUMNS + [ID_COLUMN])
+
+
+class EventJournal:
+    # Append-only journal of every store change as one JSON line:
+    #   {"seq", "time", "type": add | cancel | update | reload, "actor", "rid",
+    #    "record", "previous"} (a reload carries the full "records" instead)
+    # Every snapshot_every events, and at every reload, the whole state is
+    # written to snapshot_dir as <seq>-<time>-<journal offset after it>.json.
+    # Rebuilding the state at a given time loads the nearest earlier snapshot
+    # and replays only the events after it.
+    # backup(file_path), when given, is called on the journal and the new
+    # snapshot whenever a snapshot is taken.
+    def __init__(self, store, path, snapshot_dir, snapshot_every=200, backup=None):
+        self.store = store
+        self.path = path
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_every = snapshot_every
+        self.backup = backup
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self._snapshots = list_snapshots(snapshot_dir)
+        with store.lock:
+            store.refresh()
+            self.seq, self._state, self._since_snapshot = self._replay_all()
+            # Record whatever changed while no journal was listening
+            current = {rid: serialize(record) for rid, record in store.records().items()}
+            if current != self._state:
+                self._append({'type': 'reload', 'rid': None, 'records': current})
+            store.subscribe(self._on_change)
+
+    def _load_snapshot(self, snapshot):
+        with open(snapshot[2], 'r') as f:
+            return json.load(f)
+
+    # Current journal state: the last snapshot plus the events written after it
+    def _replay_all(self):
+        seq, state, offset = 0, {}, 0
+        if self._snapshots:
+            snapshot = self._load_snapshot(self._snapshots[-1])
+            seq, state, offset = snapshot['seq'], snapshot['records'], self._snapshots[-1][3]
+        replayed = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                f.seek(offset)
+                for line in f:
+                    event = json.loads(line)
+                    apply_event(state, event)
+                    seq = event['seq']
+                    replayed += 1
+        return seq, state, replayed
+
+    def _on_change(self, event, rid, record, previous):
+        if event == 'reload':
+            self._append({'type': 'reload', 'rid': None,
+                          'records': {rid: serialize(record) for rid, record in self.store.records().items()}})
+        else:
+            self._append({'type': event, 'rid': rid, 'record': serialize(record), 'previous': serialize(previous)})
+
+    def _append(self, event):
+        now = datetime.datetime.now()
+        self.seq += 1
+        event = {'seq': self.seq, 'time': now.strftime(JOURNAL_TIME_FORMAT), 'actor': current_actor(), **event}
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+        apply_event(self._state, event)
+        self._since_snapshot += 1
+        if event['type'] == 'reload' or self._since_snapshot >= self.snapshot_every:
+            self._snapshot(now)
+
+    def _snapshot(self, now):
+        offset = os.path.getsize(self.path)
+        file_name = f"{self.seq:08d}-{now.strftime('%Y%m%d%H%M%S%f')}-{offset}.json"
+        snapshot_path = os.path.join(self.snapshot_dir, file_name)
+        temporary_path = snapshot_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump({'seq': self.seq, 'time': now.strftime(JOURNAL_TIME_FORMAT), 'records': self._state}, f)
+        os.replace(temporary_path, snapshot_path)
+        self._snapshots.append((now, self.seq, snapshot_path, offset))
+        self._since_snapshot = 0
+        if self.backup is not None:
+            self.backup(self.path)
+            self.backup(snapshot_path)
+
+    # Nearest snapshot taken at or before a time: (state, journal offset)
+    def _start_from(self, timestamp):
+        position = bisect.bisect_right([snapshot[0] for snapshot in self._snapshots], timestamp)
+        if position == 0:
+            return {}, 0
+        snapshot = self._snapshots[position - 1]
+        return self._load_snapshot(snapshot)['records'], snapshot[3]
+
+    def _events_from(self, offset, until):
+        if not os.path.exists(self.path):
+            return
+        until = until.strftime(JOURNAL_TIME_FORMAT)
+        with open(self.path, 'r') as f:
+            f.seek(offset)
+            for line in f:
+                event = json.loads(line)
+                if event['time'] > until:
+                    return
+                yield event
+
+    # Reservations as they stood at a given time (datetime), as a DataFrame
+    def state_at(self, timestamp):
+        with self.store.lock:
+            state, offset = self._start_from(timestamp)
+            for event in self._events_from(offset, timestamp):
+                apply_event(state, event)
+        return state_frame(state)
+
+    # Changes made between two times, one row per add / cancel / update with
+    # the reservation after the change (before it for a cancellation)
+    def events_between(self, start, end):
+        start_text = start.strftime(JOURNAL_TIME_FORMAT)
+        rows = []
+        with self.store.lock:
+            _, offset = self._start_from(start)
+            for event in self._events_from(offset, end):
+                if event['time'] < start_text or event['type'] in ('reload', 'blackout'):
+                    continue
+                reservation = event['record'] or event['previous'] or {}
+                rows.append({**{column: event.get(column) for column in ['time', 'seq', 'type', 'actor', 'rid']},
+                             **{column: reservation.get(column) for column in RESERVATION_COLUMNS}})
+        return pd.DataFrame(rows, columns=EVENT_COLUMNS)
+
+    # Change feed page after a cursor, see read_changes
+    def changes(self, cursor=0, limit=100):
+        with self.store.lock:
+            return read_changes(self.path, list(self._snapshots), cursor, limit)
@@ -0,0 +1,193 @@
+import argparse
+import datetime
+import email.utils
+import hashlib
+import http.server
+import urllib.parse
+
+import pytz
+
+from reservation_store import ReservationStore, is_valid
+from tenants import Tenants
+
+PCR_FILE_PATH = 'pcr_data.csv'
+NON_PCR_FILE_PATH = 'non_pcr_data.csv'
+TENANTS_FILE_PATH = 'tenants.json'
+LAB_TIMEZONE = 'Asia/Bangkok'
+CALENDAR_NAME = 'Lab Equipments Reservation'
+
+
+# Escape a TEXT value (RFC 5545 section 3.3.11)
+def escape_text(value):
+    return str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+# Fold a content line into chunks of at most 75 octets
+def fold_line(line):
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        # Never split a multi-byte character
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    return '\r\n '.join(parts)
+
+
+def utc_stamp(value, timezone):
+    return timezone.localize(value).astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+# stamp(record) is the UTC time the reservation was last changed, its DTSTAMP
+def render_calendar(name, reservations, summary, timezone, stamp):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//Lab Equipments Reservation//EN', 'CALSCALE:GREGORIAN',
+             f'X-WR-CALNAME:{escape_text(name)}']
+    for record in reservations:
+        lines += [
+            'BEGIN:VEVENT',
+            f"UID:{record['Reservation_ID']}@lab-equipments-reservation",
+            f"DTSTAMP:{stamp(record).strftime('%Y%m%dT%H%M%SZ')}",
+            f"DTSTART:{utc_stamp(record['Start_Time'], timezone)}",
+            f"DTEND:{utc_stamp(record['End_Time'], timezone)}",
+            f"SUMMARY:{escape_text(summary(record))}",
+            f"LOCATION:{escape_text(record['Room'])}",
+            'END:VEVENT'
+        ]
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(fold_line(line) for line in lines) + '\r\n').encode('utf-8')
+
+
+class IcsFeeds:
+    # iCalendar feeds of the reservation store, one per user (('user', name))
+    # and one per equipment (('equipment', room, equipment)). A rendered feed
+    # is kept with its ETag (hash of the body) and Last-Modified time until a
+    # change event touches its user or equipment; it is then rendered again
+    # on the next request, and its Last-Modified only moves if the body
+    # really changed. A reload of the files marks every feed stale. The
+    # DTSTAMP of an event is the time its reservation was last changed, or
+    # when the files were last loaded for reservations not changed since, so
+    # an unchanged reservation always renders to the same bytes.
+    def __init__(self, store, timezone=LAB_TIMEZONE):
+        self.store = store
+        self.timezone = pytz.timezone(timezone)
+        self._feeds = {}
+        self._stale = set()
+        self._loaded_at = datetime.datetime.now(datetime.timezone.utc)
+        self._changed = {}
+        store.subscribe(self._on_change)
+
+    def _on_change(self, event, rid, record, previous):
+        if event == 'reload':
+            self._loaded_at = datetime.datetime.now(datetime.timezone.utc)
+            self._changed.clear()
+            self._stale.update(self._feeds)
+            return
+        if event != 'blackout':
+            self._changed[rid] = datetime.datetime.now(datetime.timezone.utc)
+        for reservation in (record, previous):
+            if reservation is not None and is_valid(reservation):
+                self._stale.add(('user', reservation['Name']))
+                self._stale.add(('equipment', reservation['Room'], reservation['Equipments']))
+
+    def _stamp(self, record):
+        return self._changed.get(record['Reservation_ID'], self._loaded_at)
+
+    def _render(self, key):
+        if key[0] == 'user':
+            return render_calendar(f"{CALENDAR_NAME} - {key[1]}", self.store.for_user(key[1]),
+                                   lambda record: f"{record['Equipments']} ({record['Room']})", self.timezone,
+                                   self._stamp)
+        return render_calendar(f"{CALENDAR_NAME} - {key[2]}", self.store.for_equipment(key[1], key[2]),
+                               lambda record: f"{record['Equipments']} - {record['Name']}", self.timezone,
+                               self._stamp)
+
+    # (body, etag, last_modified) of a feed
+    def feed(self, key):
+        with self.store.events_lock:
+            self.store.refresh()
+            cached = self._feeds.get(key)
+            if cached is None or key in self._stale:
+                body = self._render(key)
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if cached is None or cached[1] != etag:
+                    cached = (body, etag, datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0))
+                self._feeds[key] = cached
+                self._stale.discard(key)
+            return cached
+
+    # HTTP response of a feed as (status, headers, body), answering
+    # 304 Not Modified to a matching If-None-Match or If-Modified-Since
+    def respond(self, key, if_none_match=None, if_modified_since=None):
+        body, etag, last_modified = self.feed(key)
+        headers = {'ETag': etag, 'Last-Modified': email.utils.format_datetime(last_modified, usegmt=True),
+                   'Cache-Control': 'no-cache'}
+        if if_none_match is not None:
+            not_modified = etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        elif if_modified_since is not None:
+            try:
+                not_modified = last_modified <= email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                not_modified = False
+        else:
+            not_modified = False
+        if not_modified:
+            return 304, headers, b''
+        headers['Content-Type'] = 'text/calendar; charset=utf-8'
+        return 200, headers, body
+
+
+# Feed key of a request path: /user/<name>.ics or /equipment/<room>/<equipment>.ics
+def feed_key(path):
+    parts = [urllib.parse.unquote(part) for part in urllib.parse.urlsplit(path).path.strip('/').split('/')]
+    if not parts[-1].endswith('.ics'):
+        return None
+    parts[-1] = parts[-1][:-len('.ics')]
+    if parts[0] == 'user' and len(parts) == 2:
+        return ('user', parts[1])
+    if parts[0] == 'equipment' and len(parts) == 3:
+        return ('equipment', parts[1], parts[2])
+    return None
+
+
+def make_handler(feeds):
+    class FeedHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            key = feed_key(self.path)
+            if key is None:
+                self.send_error(404)
+                return
+            status, headers, body = feeds.respond(key, self.headers.get('If-None-Match'),
+                                                  self.headers.get('If-Modified-Since'))
+            self.send_response(status)
+            for header, value in headers.items():
+                self.send_header(header, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return FeedHandler
+
+
+# Serve the feeds read-only for calendar apps to subscribe to
+def main():
+    parser = argparse.ArgumentParser(description="iCalendar feeds of the reservations")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--tenant', help="Serve the reservations of this tenant of tenants.json")
+    args = parser.parse_args()
+    tenant = Tenants(TENANTS_FILE_PATH).from_args(parser, args.tenant)
+
+    store = ReservationStore({'pcr': tenant.path(PCR_FILE_PATH), 'non_pcr': tenant.path(NON_PCR_FILE_PATH)},
+                             writer=lambda df, file_path: None)
+    server = http.server.ThreadingHTTPServer((args.host, args.port), make_handler(IcsFeeds(store)))
+    print(f"Serving calendar feeds on http://{args.host}:{args.port}/user/<name>.ics")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
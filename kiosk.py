@@ -0,0 +1,60 @@
+import datetime
+
+from room_views import day_timeline_html
+
+
+class KioskBoard:
+    # Today's schedule of each room for the wall displays, shared by every
+    # display: per (room, day) the day's reservations and the HTML timeline.
+    # A board is only rebuilt after a change touching that room and day (or
+    # a reload of the files, or a change of the room's equipments), so any
+    # number of screens refreshing costs the same as one.
+    def __init__(self, store, policy):
+        self.store = store
+        self.policy = policy
+        self._boards = {}
+        store.subscribe(self._on_change)
+
+    def _on_change(self, event, rid, record, previous):
+        if event == 'reload':
+            self._boards.clear()
+            return
+        for reservation in (record, previous):
+            if reservation is None or not isinstance(reservation.get('Start_Time'), datetime.datetime):
+                continue
+            day = reservation['Start_Time'].date()
+            while day <= reservation['End_Time'].date():
+                self._boards.pop((reservation['Room'], day), None)
+                day += datetime.timedelta(days=1)
+
+    def _build(self, room, day, catalog):
+        day_start = datetime.datetime.combine(day, datetime.time(0, 0))
+        reservations = self.store.frame(day_start, day_start + datetime.timedelta(days=1), room=room)
+        reservations = reservations[reservations['Equipments'].isin(
+            [equipment for equipment, info in catalog[room].items() if info.get('enabled', False)])]
+        return {
+            'equipments': catalog[room],
+            'timeline': day_timeline_html(self.store, self.policy, catalog, room, day),
+            'reservations': reservations.sort_values('Start_Time')[
+                ['Equipments', 'Name', 'Start_Time', 'End_Time']].to_dict('records')
+        }
+
+    # {'timeline': html, 'reservations': [...]} of a room for a day
+    def board(self, room, day, catalog):
+        key = (room, day)
+        with self.store.events_lock:
+            self.store.refresh()
+            for old_key in [old_key for old_key in self._boards if old_key[1] < day]:
+                del self._boards[old_key]
+            board = self._boards.get(key)
+            if board is None or board['equipments'] != catalog[room]:
+                board = self._boards[key] = self._build(room, day, catalog)
+            return board
+
+
+# Reservations of a board in use at a time and those still to come
+def now_and_next(board, now):
+    in_use = [reservation for reservation in board['reservations']
+              if reservation['Start_Time'] <= now < reservation['End_Time']]
+    upcoming = [reservation for reservation in board['reservations'] if reservation['Start_Time'] > now]
+    return in_use, upcoming
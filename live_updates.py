@@ -0,0 +1,50 @@
+import datetime
+import threading
+import time
+
+
+class ChangeBus:
+    # Publishes reservation changes by (room, day). Every change event of the
+    # store bumps the counter of each (room, day) the reservation covered or
+    # now covers; a reload of the files bumps the epoch, which touches every
+    # key. Watchers compare versions() with what they last drew and redraw
+    # only when their own keys moved. poll() asks the store for changes made
+    # by other processes (file signatures, or the service's change feed) at
+    # most once per refresh_interval seconds, whoever is asking.
+    def __init__(self, store, refresh_interval=1.0):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self._counters = {}
+        self._epoch = 0
+        self._last_refresh = 0.0
+        self._refresh_lock = threading.Lock()
+        store.subscribe(self._on_change)
+
+    def _on_change(self, event, rid, record, previous):
+        if event == 'reload':
+            self._epoch += 1
+            return
+        for reservation in (record, previous):
+            if reservation is None or not isinstance(reservation.get('Start_Time'), datetime.datetime):
+                continue
+            day = reservation['Start_Time'].date()
+            while day <= reservation['End_Time'].date():
+                key = (reservation['Room'], day)
+                self._counters[key] = self._counters.get(key, 0) + 1
+                day += datetime.timedelta(days=1)
+
+    def poll(self):
+        if time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        # One caller refreshes, the others keep the versions they already have
+        if self._refresh_lock.acquire(blocking=False):
+            try:
+                self.store.refresh()
+                self._last_refresh = time.monotonic()
+            finally:
+                self._refresh_lock.release()
+
+    # Current version of each watched (room, day)
+    def versions(self, keys):
+        self.poll()
+        return [(self._epoch, self._counters.get(key, 0)) for key in keys]
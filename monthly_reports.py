@@ -0,0 +1,150 @@
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import html
+import json
+import os
+import re
+
+import pandas as pd
+
+from reservation_store import ReservationStore
+from tenants import Tenants
+
+PCR_FILE_PATH = 'pcr_data.csv'
+NON_PCR_FILE_PATH = 'non_pcr_data.csv'
+REPORTS_DIR = 'reports'
+TENANTS_FILE_PATH = 'tenants.json'
+MANIFEST_NAME = 'manifest.json'
+
+
+# Research group of a user, from the "_4511" style suffix of their name
+def research_group(names):
+    return names.str.extract(r'_(\d+)\s*$', expand=False).fillna('Other')
+
+
+def month_bounds(month):
+    first = datetime.datetime.strptime(month, '%Y-%m')
+    last = (first + datetime.timedelta(days=32)).replace(day=1)
+    return first, last
+
+
+# The month's reservations, clipped to the month, with their group and hours
+def month_reservations(store, month):
+    first, last = month_bounds(month)
+    df = store.frame(first, last)
+    df['Start_Time'] = df['Start_Time'].clip(lower=first)
+    df['End_Time'] = df['End_Time'].clip(upper=last)
+    df['Group'] = research_group(df['Name'])
+    df['Hours'] = (df['End_Time'] - df['Start_Time']).dt.total_seconds() / 3600
+    return df.sort_values(['Start_Time', 'Reservation_ID'], ignore_index=True)
+
+
+def slugify(value):
+    return re.sub(r'[^A-Za-z0-9]+', '_', str(value)).strip('_') or 'unnamed'
+
+
+# Content hash of a partition, so unchanged partitions are not rendered again
+def fingerprint(partition):
+    return hashlib.sha1(partition.to_csv(index=False).encode('utf-8')).hexdigest()
+
+
+# Statistics of one partition: usage per equipment and per user
+def partition_stats(partition):
+    per_equipment = partition.groupby(['Room', 'Equipments']).agg(
+        Reservations=('Reservation_ID', 'size'), Booked_Hours=('Hours', 'sum'), Users=('Name', 'nunique'))
+    per_user = partition.groupby(['Group', 'Name']).agg(
+        Reservations=('Reservation_ID', 'size'), Booked_Hours=('Hours', 'sum'), Equipments=('Equipments', 'nunique'))
+    return per_equipment.round(2).reset_index(), per_user.round(2).reset_index()
+
+
+# Worker: write the CSV and HTML reports of one partition
+def render_partition(title, partition, csv_path, html_path):
+    per_equipment, per_user = partition_stats(partition)
+    per_equipment.to_csv(csv_path, index=False)
+    title = html.escape(title)
+    with open(html_path, 'w') as f:
+        f.write(f"<html><head><meta charset='utf-8'><title>{title}</title></head><body>"
+                f"<h1>{title}</h1>"
+                f"<p>{len(partition)} reservations, {partition['Hours'].sum():.1f} booked hours, "
+                f"{partition['Name'].nunique()} users.</p>"
+                f"<h2>Per equipment</h2>{per_equipment.to_html(index=False)}"
+                f"<h2>Per user</h2>{per_user.to_html(index=False)}"
+                f"</body></html>")
+    return csv_path
+
+
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+# Render the reports of one month partitioned by 'room' or 'group' into
+# output_dir/<month>/<by>/ with a process pool. The manifest remembers the
+# fingerprint of every rendered partition; only partitions whose
+# reservations changed since the last run (or whose files are gone) are
+# rendered again, and partitions that no longer exist (every reservation of
+# a room or group moved out of the month) lose their entry and their files.
+# Returns the paths of the reports written in this run.
+def generate_reports(store, month, by, output_dir=REPORTS_DIR, workers=None):
+    column = {'room': 'Room', 'group': 'Group'}[by]
+    target_dir = os.path.join(output_dir, month, by)
+    os.makedirs(target_dir, exist_ok=True)
+    manifest_path = os.path.join(target_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    reservations = month_reservations(store, month)
+    jobs = []
+    names = set()
+    for key, partition in reservations.groupby(column):
+        name = slugify(key)
+        names.add(name)
+        csv_path = os.path.join(target_dir, f'{name}.csv')
+        html_path = os.path.join(target_dir, f'{name}.html')
+        digest = fingerprint(partition)
+        if manifest.get(name) == digest and os.path.exists(csv_path) and os.path.exists(html_path):
+            continue
+        manifest[name] = digest
+        title = f"{'Room' if by == 'room' else 'Group'} {key} - {month}"
+        jobs.append((title, partition, csv_path, html_path))
+
+    for name in set(manifest) - names:
+        del manifest[name]
+        for extension in ('csv', 'html'):
+            stale_path = os.path.join(target_dir, f'{name}.{extension}')
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+
+    written = []
+    if jobs:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            written = list(pool.map(render_partition, *zip(*jobs)))
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    return written
+
+
+def main():
+    last_month = datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+    parser = argparse.ArgumentParser(description="Monthly usage reports per room or research group")
+    parser.add_argument('month', nargs='?', default=last_month.strftime('%Y-%m'), help="YYYY-MM, last month by default")
+    parser.add_argument('--by', choices=['room', 'group', 'both'], default='both')
+    parser.add_argument('--output', default=None, help="reports folder of the tenant by default")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--tenant', help="Report on this tenant of tenants.json")
+    args = parser.parse_args()
+    tenant = Tenants(TENANTS_FILE_PATH).from_args(parser, args.tenant)
+
+    # Read-only: never write the reservation files back from a report run
+    store = ReservationStore({'pcr': tenant.path(PCR_FILE_PATH), 'non_pcr': tenant.path(NON_PCR_FILE_PATH)},
+                             writer=lambda df, file_path: None)
+    for by in (['room', 'group'] if args.by == 'both' else [args.by]):
+        written = generate_reports(store, args.month, by, args.output or tenant.path(REPORTS_DIR), args.workers)
+        print(f"{args.month} per {by}: {len(written)} report(s) updated")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import datetime
+import fcntl
+import heapq
+import mailbox
+import smtplib
+import threading
+from email.message import EmailMessage
+
+TIME_FORMAT = '%Y/%m/%d %H:%M'
+
+
+class FileTransport:
+    # Appends every message to an mbox file, for tests and setups without a mail server
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, messages):
+        box = mailbox.mbox(self.path)
+        box.lock()
+        try:
+            for message in messages:
+                box.add(message)
+            box.flush()
+        finally:
+            box.unlock()
+            box.close()
+
+
+class SmtpTransport:
+    # Sends a whole batch over one SMTP connection
+    def __init__(self, host, port=25, username=None, password=None, starttls=False, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, messages):
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message in messages:
+                smtp.send_message(message)
+
+
+# Transport from a settings mapping (the [notifications] section of the
+# secrets): transport = "smtp" with host/port/username/password/starttls,
+# or "file" (the default) with path
+def make_transport(settings):
+    settings = dict(settings or {})
+    if settings.get('transport', 'file') == 'smtp':
+        return SmtpTransport(settings['host'], int(settings.get('port', 25)), settings.get('username'),
+                             settings.get('password'), bool(settings.get('starttls', False)))
+    return FileTransport(settings.get('path', 'notifications.mbox'))
+
+
+class Notifier:
+    # Email reminders before reservations start, plus one-off notices.
+    # Reminders sit in a heap of (send time, reservation ID) kept in step
+    # with the store's change events: a cancelled or moved reservation only
+    # drops its entry from _due, and stale heap entries are skipped when they
+    # come up, so tens of thousands of pending reminders cost one heap push
+    # each. Due reminders and notices wait in an outbox that a background
+    # thread hands to the transport as one batch every batch_seconds.
+    # emails maps user names (the Name column) to addresses. When several
+    # processes serve the same files, only the one holding an exclusive
+    # flock on leader_path sends the reminders; notices are sent by the
+    # process that queued them.
+    def __init__(self, store, emails, transport, sender, lead=datetime.timedelta(hours=1), batch_seconds=30,
+                 leader_path=None):
+        self.store = store
+        self.emails = dict(emails)
+        self.transport = transport
+        self.sender = sender
+        self.lead = lead
+        self.batch_seconds = batch_seconds
+        self.leader_path = leader_path
+        self._leader_file = None
+        self._lock = threading.Lock()
+        self._heap = []
+        self._due = {}
+        self._outbox = []
+        self._stop = threading.Event()
+        self._thread = None
+        store.subscribe(self._on_change)
+        with store.events_lock:
+            store.refresh()
+            self._rebuild(store.records())
+
+    # Schedule every reminder still to come; reminders whose time already
+    # passed are not sent again after a restart or a reload of the files,
+    # but those that were due and not yet sent are kept
+    def _rebuild(self, records, now=None):
+        now = now or datetime.datetime.now()
+        with self._lock:
+            pending = self._due
+            self._heap = []
+            self._due = {}
+            for rid, record in records.items():
+                if isinstance(record.get('Start_Time'), datetime.datetime) and (
+                        record['Start_Time'] - self.lead > now or rid in pending):
+                    self._schedule(rid, record, now)
+
+    # A reservation made (or moved) inside the lead time is reminded right away
+    def _schedule(self, rid, record, now):
+        if record['Start_Time'] <= now or record.get('Name') not in self.emails:
+            return
+        send_at = max(record['Start_Time'] - self.lead, now)
+        self._due[rid] = (send_at, record)
+        heapq.heappush(self._heap, (send_at, rid))
+
+    def _on_change(self, event, rid, record, previous):
+        if event == 'reload':
+            self._rebuild(self.store.records())
+            return
+        with self._lock:
+            self._due.pop(rid, None)
+            if record is not None and isinstance(record.get('Start_Time'), datetime.datetime):
+                self._schedule(rid, record, datetime.datetime.now())
+
+    def _message(self, name, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = self.emails[name]
+        message['Subject'] = subject
+        message.set_content(body)
+        return message
+
+    # Queue a notice for some users; those without an address are skipped
+    def notify(self, names, subject, body):
+        with self._lock:
+            for name in set(names):
+                if name in self.emails:
+                    self._outbox.append(self._message(name, subject, body))
+
+    # Tell everyone holding a future reservation of an equipment that it was switched off
+    def equipment_disabled(self, room, equipment, now=None):
+        now = now or datetime.datetime.now()
+        upcoming = [record for record in self.store.for_equipment(room, equipment) if record['End_Time'] > now]
+        for name in {record['Name'] for record in upcoming}:
+            times = '\n'.join(f"- {record['Start_Time'].strftime(TIME_FORMAT)} to "
+                              f"{record['End_Time'].strftime(TIME_FORMAT)}"
+                              for record in upcoming if record['Name'] == name)
+            self.notify([name], f"{equipment} is currently unavailable",
+                        f"Dear {name},\n\n{equipment} in {room} has been switched off by the administrators. "
+                        f"Your reservations on it:\n{times}\n\nPlease contact the lab staff before using it.")
+
+    # Move every reminder due by now to the outbox
+    def run_due(self, now=None):
+        now = now or datetime.datetime.now()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                send_at, rid = heapq.heappop(self._heap)
+                due = self._due.get(rid)
+                if due is None or due[0] != send_at:
+                    continue
+                del self._due[rid]
+                record = due[1]
+                self._outbox.append(self._message(
+                    record['Name'],
+                    f"Reminder: {record['Equipments']} at {record['Start_Time'].strftime('%H:%M')}",
+                    f"Dear {record['Name']},\n\nYour reservation of {record['Equipments']} in {record['Room']} "
+                    f"starts at {record['Start_Time'].strftime(TIME_FORMAT)} and ends at "
+                    f"{record['End_Time'].strftime(TIME_FORMAT)}."))
+
+    # Hand the outbox to the transport as one batch; a failed batch is kept for the next try
+    def flush(self):
+        with self._lock:
+            messages, self._outbox = self._outbox, []
+        if not messages:
+            return 0
+        try:
+            self.transport.send(messages)
+        except (OSError, smtplib.SMTPException) as e:
+            print(f"An error occurred while sending {len(messages)} notification(s): {e}")
+            with self._lock:
+                self._outbox = messages + self._outbox
+            return 0
+        return len(messages)
+
+    def pending(self):
+        with self._lock:
+            return len(self._due)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    # Whether this process sends the reminders: it holds the flock on
+    # leader_path, taking it over once the previous holder exits
+    def is_leader(self):
+        if self.leader_path is None or self._leader_file is not None:
+            return True
+        leader_file = open(self.leader_path, 'a')
+        try:
+            fcntl.flock(leader_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            leader_file.close()
+            return False
+        self._leader_file = leader_file
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.batch_seconds):
+            if self.is_leader():
+                # Pick up reservations written by other processes first
+                self.store.refresh()
+                self.run_due()
+            self.flush()
+        if self._leader_file is not None:
+            self._leader_file.close()
+            self._leader_file = None
@@ -0,0 +1,110 @@
+import datetime
+
+import pandas as pd
+
+from reservation_store import is_valid
+
+QUOTA_COLUMNS = ['Name', 'Role', 'Equipment_Class', 'Hours', 'Quota', 'Used']
+
+
+# Monday 00:00 of the week holding a time
+def week_start(moment):
+    return datetime.datetime.combine(moment.date() - datetime.timedelta(days=moment.weekday()), datetime.time(0, 0))
+
+
+# Hours of [start_time, end_time) falling in each week, as (week start, hours) pairs
+def week_pieces(start_time, end_time):
+    pieces = []
+    week = week_start(start_time)
+    while week < end_time:
+        next_week = week + datetime.timedelta(weeks=1)
+        hours = (min(end_time, next_week) - max(start_time, week)).total_seconds() / 3600
+        if hours > 0:
+            pieces.append((week, hours))
+        week = next_week
+    return pieces
+
+
+class QuotaLedger:
+    # Hours booked per user, week and equipment, from the current week on:
+    #   hours[week start][name][equipment] -> hours
+    # kept in step with the store's change events, so checking a quota adds
+    # up a handful of numbers instead of rescanning the reservations. Weeks
+    # that have ended are dropped as time moves on.
+    def __init__(self, store):
+        self.store = store
+        self.hours = {}
+        self._current_week = week_start(datetime.datetime.now())
+        with store.events_lock:
+            store.refresh()
+            self._rebuild()
+            store.subscribe(self._on_change)
+
+    def _rebuild(self):
+        self.hours = {}
+        for record in self.store.records().values():
+            self._add(record, 1)
+
+    def _add(self, record, sign):
+        if not is_valid(record) or record['End_Time'] <= self._current_week:
+            return
+        for week, hours in week_pieces(record['Start_Time'], record['End_Time']):
+            if week < self._current_week:
+                continue
+            equipments = self.hours.setdefault(week, {}).setdefault(record['Name'], {})
+            equipments[record['Equipments']] = equipments.get(record['Equipments'], 0.0) + sign * hours
+            if abs(equipments[record['Equipments']]) < 1e-9:
+                del equipments[record['Equipments']]
+                if not equipments:
+                    del self.hours[week][record['Name']]
+
+    def _on_change(self, event, rid, record, previous):
+        if event == 'reload':
+            self._rebuild()
+            return
+        if event == 'blackout':
+            return
+        if previous is not None:
+            self._add(previous, -1)
+        if record is not None:
+            self._add(record, 1)
+
+    # Drop the weeks that have ended
+    def _roll(self, now):
+        current_week = week_start(now)
+        if current_week > self._current_week:
+            self._current_week = current_week
+            for week in [week for week in self.hours if week < current_week]:
+                del self.hours[week]
+
+    # Hours a user holds in the week starting at week, on the equipments whose
+    # name contains equipment_class (all of them when None)
+    def booked(self, name, week, equipment_class=None, now=None):
+        with self.store.events_lock:
+            self.store.refresh()
+            self._roll(now or datetime.datetime.now())
+            equipments = self.hours.get(week, {}).get(name, {})
+            return sum(hours for equipment, hours in equipments.items()
+                       if equipment_class is None or equipment_class in equipment)
+
+    # Usage against quota of everyone holding hours in the week of now: one
+    # row per user and quota class, the classes coming from the
+    # max_hours_per_week rules the policy picks for the user's role.
+    # roles maps user names to roles.
+    def usage(self, policy, roles, now=None):
+        now = now or datetime.datetime.now()
+        totals = {}
+        with self.store.events_lock:
+            self.store.refresh()
+            self._roll(now)
+            for name, equipments in self.hours.get(week_start(now), {}).items():
+                role = roles.get(name)
+                for equipment, hours in equipments.items():
+                    rule = policy.quota_rule(role, equipment)
+                    if rule is None:
+                        continue
+                    key = (name, role, rule.get('equipment') or 'All', rule['hours'])
+                    totals[key] = totals.get(key, 0.0) + hours
+        df = pd.DataFrame([(*key[:3], hours, key[3]) for key, hours in totals.items()], columns=QUOTA_COLUMNS[:-1])
+        df['Used'] = df['Hours'] / df['Quota']
+        return df.sort_values('Used', ascending=False, ignore_index=True)
@@ -0,0 +1,63 @@
+import datetime
+import os
+
+RECURRENCE_STEPS = {
+    'Daily': datetime.timedelta(days=1),
+    'Weekly': datetime.timedelta(weeks=1)
+}
+
+
+# Dates listed one per line (YYYY-MM-DD) in the holidays file
+def load_holidays(file_path):
+    holidays = set()
+    if os.path.exists(file_path):
+        with open(file_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    holidays.add(datetime.datetime.strptime(line, '%Y-%m-%d').date())
+    return holidays
+
+
+# Expand one booking into its occurrences up to and including the until date
+def expand_series(start_datetime, end_datetime, frequency, until, skip_dates=(), skip_weekends=False):
+    step = RECURRENCE_STEPS[frequency]
+    occurrences = []
+    start, end = start_datetime, end_datetime
+    while start.date() <= until:
+        if start.date() not in skip_dates and not (skip_weekends and start.weekday() >= 5):
+            occurrences.append((start, end))
+        start, end = start + step, end + step
+    return occurrences
+
+
+# Book every occurrence of a series with a single write. All occurrences are
+# checked in one pass under the store lock, against the booking policy when
+# one is given or else only against the interval index. With all_or_nothing
+# a single refused occurrence books nothing, otherwise the free ones are
+# booked. Returns the new reservation IDs and the (start, end) occurrences
+# that were refused.
+def book_series(store, name, room, equipment, occurrences, all_or_nothing=True, policy=None, role=None):
+    # A reservation service checks and books the series under its own lock, with its own rules
+    if store.remote:
+        rids, clashes = store.call('bookings', 'book_series', name, room, equipment, occurrences, all_or_nothing,
+                                   role)
+        return rids, [tuple(clash) for clash in clashes]
+    candidates = [{
+        'Name': name,
+        'Room': room,
+        'Equipments': equipment,
+        'Start_Time': start,
+        'End_Time': end
+    } for start, end in occurrences]
+    with store.lock:
+        if policy is not None:
+            found = policy.check(store, role, candidates)
+        else:
+            found = store.find_conflicts([(room, equipment, start, end) for start, end in occurrences])
+        clashes = [occurrence for occurrence, problems in zip(occurrences, found) if problems]
+        free = [candidate for candidate, problems in zip(candidates, found) if not problems]
+        if not free or (all_or_nothing and clashes):
+            return [], clashes
+        rids = store.add_many(free)
+    return rids, clashes
@@ -0,0 +1,190 @@
+import http.client
+import json
+import socket
+import threading
+import urllib.parse
+
+import pandas as pd
+
+from event_journal import current_actor
+from reservation_service import decode, encode
+from reservation_store import parse_time
+
+ERRORS = {'KeyError': KeyError, 'ValueError': ValueError}
+
+
+def parse_record(record):
+    if record is None:
+        return None
+    return {**record, 'Start_Time': parse_time(record['Start_Time']), 'End_Time': parse_time(record['End_Time'])}
+
+
+class ReservationClient:
+    # Drop-in replacement for ReservationStore talking to reservation_service
+    # over HTTP. Every thread keeps its own connection open between calls.
+    # Subscribers get the same (event, rid, record, previous) callbacks as
+    # with a local store: refresh() reads the service's change feed from
+    # the last cursor seen and replays the new events, and version counts
+    # the events seen so far. There is no store lock on this side: every
+    # check-then-write is a single call that the service runs under its own
+    # lock (see BookingRpc). events_lock only orders the replay of events
+    # with the readers of caches built from them.
+    remote = True
+
+    def __init__(self, url, timeout=30):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port
+        self.timeout = timeout
+        self.events_lock = threading.RLock()
+        self.journal = JournalClient(self)
+        self.waitlist = WaitlistClient(self)
+        self._local = threading.local()
+        self._listeners = []
+        self._version = 0
+        self._cursor = self.call('journal', 'head')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            connection.connect()
+            # Headers and body go out in separate writes: don't let Nagle hold the body back
+            connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._local.connection = connection
+        return connection
+
+    def call(self, target, method, *args, **kwargs):
+        body = json.dumps(encode({'args': args, 'kwargs': kwargs}))
+        headers = {'Content-Type': 'application/json', 'X-Actor': current_actor() or ''}
+        # A kept-alive connection may have been closed by the service: retry once on a new one
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request('POST', f'/rpc/{target}/{method}', body, headers)
+                payload = json.loads(connection.getresponse().read(), object_hook=decode)
+                break
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        if 'error' in payload:
+            raise ERRORS.get(payload['error']['type'], RuntimeError)(payload['error']['message'])
+        return payload['result']
+
+    @property
+    def version(self):
+        self.refresh()
+        return self._version
+
+    def subscribe(self, callback):
+        with self.events_lock:
+            self._listeners.append(callback)
+
+    def refresh(self):
+        with self.events_lock:
+            while True:
+                page = self.call('journal', 'changes', self._cursor, 500)
+                for event in page['changes']:
+                    self._version += 1
+                    record, previous = parse_record(event.get('record')), parse_record(event.get('previous'))
+                    for callback in self._listeners:
+                        callback(event['type'], event['rid'], record, previous)
+                self._cursor = page['cursor']
+                if not page['has_more']:
+                    return
+
+    def get(self, rid):
+        return self.call('store', 'get', rid)
+
+    def records(self):
+        return self.call('store', 'records')
+
+    def add(self, name, room, equipment, start_time, end_time):
+        return self.call('store', 'add', name, room, equipment, start_time, end_time)
+
+    def add_many(self, reservations):
+        return self.call('store', 'add_many', reservations)
+
+    def cancel(self, rid):
+        return self.call('store', 'cancel', rid)
+
+    def commit(self, adds=(), cancels=(), updates=None, blackouts=()):
+        return self.call('store', 'commit', adds, cancels, updates, blackouts)
+
+    def update(self, rid, **changes):
+        return self.call('store', 'update', rid, **changes)
+
+    def conflicts(self, room, equipment, start_time, end_time):
+        return self.call('store', 'conflicts', room, equipment, start_time, end_time)
+
+    def find_conflicts(self, candidates):
+        return self.call('store', 'find_conflicts', candidates)
+
+    def frame(self, start_time=None, end_time=None, room=None):
+        df = self.call('store', 'frame', start_time, end_time, room)
+        df['Start_Time'] = pd.to_datetime(df['Start_Time'])
+        df['End_Time'] = pd.to_datetime(df['End_Time'])
+        return df
+
+    def upcoming_for_user(self, name, now=None, horizon_days=60):
+        return [tuple(item) for item in self.call('store', 'upcoming_for_user', name, now, horizon_days)]
+
+    def for_user(self, name):
+        return self.call('store', 'for_user', name)
+
+    def for_equipment(self, room, equipment):
+        return self.call('store', 'for_equipment', room, equipment)
+
+    def blackouts(self, room=None, start_time=None, end_time=None):
+        return self.call('store', 'blackouts', room, start_time, end_time)
+
+    def blackout_collisions(self, room, equipment, start_time, end_time):
+        return self.call('store', 'blackout_collisions', room, equipment, start_time, end_time)
+
+    def add_blackout(self, room, equipment, start_time, end_time, reason, cancel_collisions=False):
+        return tuple(self.call('store', 'add_blackout', room, equipment, start_time, end_time, reason,
+                               cancel_collisions))
+
+    def remove_blackout(self, bid):
+        return self.call('store', 'remove_blackout', bid)
+
+    def replace(self, kind, df):
+        return self.call('store', 'replace', kind, df)
+
+
+class JournalClient:
+    # The service's event journal, with the same reading methods as EventJournal
+    def __init__(self, client):
+        self.client = client
+
+    def changes(self, cursor=0, limit=100):
+        return self.client.call('journal', 'changes', cursor, limit)
+
+    def state_at(self, timestamp):
+        return self.client.call('journal', 'state_at', timestamp)
+
+    def events_between(self, start, end):
+        return self.client.call('journal', 'events_between', start, end)
+
+
+class WaitlistClient:
+    # The service's waitlist, with the same methods as Waitlist
+    def __init__(self, client):
+        self.client = client
+
+    def join(self, name, role, room, equipment, start_time, end_time, now=None):
+        return self.client.call('waitlist', 'join', name, role, room, equipment, start_time, end_time, now)
+
+    def leave(self, wid, name):
+        return self.client.call('waitlist', 'leave', wid, name)
+
+    def cancel_and_promote(self, rid, now=None):
+        record, promoted = self.client.call('waitlist', 'cancel_and_promote', rid, now)
+        return parse_record(record), promoted
+
+    def for_user(self, name):
+        return self.client.call('waitlist', 'for_user', name)
+
+    def mark_notified(self, wids, now=None):
+        return self.client.call('waitlist', 'mark_notified', wids, now)
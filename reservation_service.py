@@ -0,0 +1,235 @@
+import argparse
+import datetime
+import json
+import os
+import queue
+import subprocess
+import threading
+import http.server
+
+import pandas as pd
+
+from batch_ops import apply_batch, plan_batch
+from booking_policy import BookingPolicy
+from bulk_import import import_reservations
+from bundles import book_bundle
+from event_journal import EventJournal, set_actor
+from ics_feeds import IcsFeeds, make_handler
+from quotas import QuotaLedger
+from recurring import book_series
+from reservation_store import ReservationStore
+from waitlist import Waitlist
+from tenants import Tenants
+
+PCR_FILE_PATH = 'pcr_data.csv'
+NON_PCR_FILE_PATH = 'non_pcr_data.csv'
+JOURNAL_FILE_PATH = 'reservation_events.jsonl'
+JOURNAL_SNAPSHOT_DIR = 'journal_snapshots'
+BLACKOUTS_FILE_PATH = 'blackouts.csv'
+BOOKING_RULES_FILE_PATH = 'booking_rules.json'
+WAITLIST_FILE_PATH = 'waitlist.csv'
+WAITLIST_ORDERING = 'fifo'
+TENANTS_FILE_PATH = 'tenants.json'
+
+# Methods a client may call, per target object
+RPC_METHODS = {
+    'store': {'get', 'records', 'add', 'add_many', 'cancel', 'commit', 'update', 'conflicts', 'find_conflicts',
+              'frame', 'upcoming_for_user', 'for_user', 'for_equipment', 'blackouts', 'blackout_collisions',
+              'add_blackout', 'remove_blackout', 'replace'},
+    'bookings': {'check', 'book', 'book_series', 'book_bundle', 'import_reservations', 'plan_batch', 'apply_batch'},
+    'waitlist': {'join', 'leave', 'cancel_and_promote', 'for_user', 'mark_notified'},
+    'journal': {'head', 'changes', 'state_at', 'events_between'}
+}
+ERROR_STATUS = {'KeyError': 404, 'ValueError': 400}
+
+
+# JSON encoding of RPC values: datetimes and DataFrames are tagged so the
+# other side gets the same types back
+def encode(value):
+    if isinstance(value, pd.DataFrame):
+        return {'$frame': encode(value.astype(object).where(value.notna(), None).to_dict('records')),
+                'columns': list(value.columns)}
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {'$timedelta': value.total_seconds()}
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    return value
+
+
+def decode(value):
+    if '$datetime' in value:
+        return datetime.datetime.fromisoformat(value['$datetime'])
+    if '$timedelta' in value:
+        return datetime.timedelta(seconds=value['$timedelta'])
+    if '$frame' in value:
+        return pd.DataFrame(value['$frame'], columns=value['columns'])
+    return value
+
+
+# Git backups of written files, pushed by one background thread so a slow
+# push never holds the store lock. Several writes of the same file waiting
+# in the queue are backed up once.
+class BackupQueue:
+    def __init__(self):
+        self._pending = set()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def put(self, file_path):
+        with self._lock:
+            if file_path in self._pending:
+                return
+            self._pending.add(file_path)
+        self._queue.put(file_path)
+
+    def _run(self):
+        while True:
+            file_path = self._queue.get()
+            with self._lock:
+                self._pending.discard(file_path)
+            try:
+                subprocess.run(["git", "add", file_path], check=True)
+                subprocess.run(["git", "commit", "-m", f"Update {os.path.basename(file_path)}"], check=True)
+                subprocess.run(["git", "push"], check=True)
+            except subprocess.CalledProcessError as e:
+                print(f"An error occurred while backing up {file_path} to GitHub: {e}")
+
+
+class JournalRpc:
+    # The journal calls a client needs; head is the cursor of the last event
+    def __init__(self, journal):
+        self.journal = journal
+
+    def head(self):
+        with self.journal.store.lock:
+            return self.journal.seq
+
+    def changes(self, cursor=0, limit=100):
+        return self.journal.changes(cursor, limit)
+
+    def state_at(self, timestamp):
+        return self.journal.state_at(timestamp)
+
+    def events_between(self, start, end):
+        return self.journal.events_between(start, end)
+
+
+class BookingRpc:
+    # Check-then-write operations run whole inside the service, under the
+    # store lock and against the service's booking rules, so two app
+    # replicas can never both pass a check and then both write
+    def __init__(self, store, policy):
+        self.store = store
+        self.policy = policy
+
+    def check(self, role, candidates, now=None, skip=()):
+        return self.policy.check(self.store, role, candidates, now, set(skip))
+
+    def book(self, role, candidates, now=None, skip=()):
+        return self.policy.book(self.store, role, candidates, now, set(skip))
+
+    def book_series(self, name, room, equipment, occurrences, all_or_nothing=True, role=None):
+        return book_series(self.store, name, room, equipment, [tuple(occurrence) for occurrence in occurrences],
+                           all_or_nothing, self.policy, role)
+
+    def book_bundle(self, name, legs, max_shift=datetime.timedelta(days=7), role=None):
+        return book_bundle(self.store, name, legs, max_shift, self.policy, role)
+
+    def import_reservations(self, rows, catalog, all_or_nothing=True):
+        return import_reservations(self.store, rows, catalog, all_or_nothing)
+
+    def plan_batch(self, rids, action, room=None, equipment=None, shift=None, name=None, catalog=None, role=None):
+        return plan_batch(self.store, rids, action, room, equipment, shift, name, catalog, self.policy, role)
+
+    def apply_batch(self, rids, action, room=None, equipment=None, shift=None, name=None, catalog=None, role=None):
+        return apply_batch(self.store, rids, action, room, equipment, shift, name, catalog, self.policy, role)
+
+
+def make_service_handler(targets, feeds):
+    class ServiceHandler(make_handler(feeds)):
+        # Keep connections open between calls, and send small replies at once
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        # POST /rpc/<target>/<method> {"args": [...], "kwargs": {...}}
+        # -> {"result": ...} or {"error": {"type", "message"}}
+        def do_POST(self):
+            parts = self.path.strip('/').split('/')
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}', object_hook=decode)
+            if len(parts) != 3 or parts[0] != 'rpc' or parts[2] not in RPC_METHODS.get(parts[1], ()):
+                status, payload = 404, {'error': {'type': 'LookupError', 'message': f"Unknown call {self.path}"}}
+            else:
+                set_actor(self.headers.get('X-Actor') or None)
+                try:
+                    result = getattr(targets[parts[1]], parts[2])(*request.get('args', []),
+                                                                  **request.get('kwargs', {}))
+                    status, payload = 200, {'result': result}
+                except Exception as e:
+                    error_type = type(e).__name__
+                    message = e.args[0] if e.args else str(e)
+                    status, payload = ERROR_STATUS.get(error_type, 500), {'error': {'type': error_type,
+                                                                                     'message': str(message)}}
+            body = json.dumps(encode(payload)).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ServiceHandler
+
+
+# Run the reservation service: the only process reading and writing the
+# reservation files. It owns the indexed store and its lock, the booking
+# rules and the waitlist (so every check-then-write runs here), the event
+# journal (whose change feed keeps the clients' caches in step) and the
+# calendar feeds, and answers the Streamlit app through ReservationClient.
+def main():
+    parser = argparse.ArgumentParser(description="Reservation service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--backup', action='store_true', help="Back up every written file to GitHub")
+    parser.add_argument('--tenant', help="Serve the files of this tenant of tenants.json (one service per tenant)")
+    args = parser.parse_args()
+
+    # The tenant's folder holds the same file names as the app folder, and
+    # backups go to whatever repository that folder belongs to. Shared
+    # configuration the tenant does not override is found before moving there.
+    tenant = Tenants(TENANTS_FILE_PATH).from_args(parser, args.tenant)
+    booking_rules_path = os.path.abspath(tenant.config_path(BOOKING_RULES_FILE_PATH))
+    if args.tenant:
+        tenant.init_root()
+        os.chdir(tenant.root)
+
+    backups = BackupQueue() if args.backup else None
+
+    def writer(df, file_path):
+        df.to_csv(file_path, index=False)
+        if backups is not None:
+            backups.put(file_path)
+
+    store = ReservationStore({'pcr': PCR_FILE_PATH, 'non_pcr': NON_PCR_FILE_PATH}, writer=writer,
+                             blackout_path=BLACKOUTS_FILE_PATH)
+    journal = EventJournal(store, JOURNAL_FILE_PATH, JOURNAL_SNAPSHOT_DIR,
+                           backup=backups.put if backups is not None else None)
+    with open(booking_rules_path, 'r') as f:
+        policy = BookingPolicy(json.load(f), ledger=QuotaLedger(store))
+    targets = {'store': store, 'journal': JournalRpc(journal), 'bookings': BookingRpc(store, policy),
+               'waitlist': Waitlist(store, policy, WAITLIST_FILE_PATH, WAITLIST_ORDERING, writer=writer)}
+    server = http.server.ThreadingHTTPServer((args.host, args.port),
+                                             make_service_handler(targets, IcsFeeds(store)))
+    print(f"Reservation service listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
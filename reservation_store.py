@@ -0,0 +1,469 @@
+import bisect
+import datetime
+import hashlib
+import os
+import threading
+import uuid
+
+import pandas as pd
+
+TIME_FORMAT = '%Y/%m/%d %H:%M:%S'
+RESERVATION_COLUMNS = ['Name', 'Room', 'Equipments', 'Start_Time', 'End_Time']
+ID_COLUMN = 'Reservation_ID'
+BLACKOUT_COLUMNS = ['Room', 'Equipments', 'Start_Time', 'End_Time', 'Reason', 'Blackout_ID']
+# Equipments value of a blackout closing a whole room
+ROOM_WIDE = '*'
+
+
+# PCR machines live in their own file, everything else goes to the general one
+def reservation_kind(equipment):
+    return 'pcr' if "PCR" in equipment else 'non_pcr'
+
+
+# Parse a stored time value, keeping the raw value when it cannot be parsed
+def parse_time(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    try:
+        return datetime.datetime.strptime(str(value), TIME_FORMAT)
+    except ValueError:
+        return value
+
+
+def format_time(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime(TIME_FORMAT)
+    return value
+
+
+# Rows written before reservations had IDs get one derived from their content,
+# so every process assigns them the same ID until the file is rewritten
+def legacy_reservation_id(row, occurrence):
+    key = '|'.join(str(row.get(column)) for column in RESERVATION_COLUMNS) + f'|{occurrence}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+def new_reservation_id():
+    return uuid.uuid4().hex[:12]
+
+
+# A reservation is only indexed when both of its times could be parsed
+def is_valid(record):
+    return (isinstance(record.get('Start_Time'), datetime.datetime)
+            and isinstance(record.get('End_Time'), datetime.datetime)
+            and isinstance(record.get('Name'), str))
+
+
+class ReservationStore:
+    # paths maps a reservation kind ('pcr' / 'non_pcr') to its CSV file.
+    # writer(df, file_path) persists a file; app.py passes save_data so that
+    # every write is still backed up the usual way. Maintenance and blackout
+    # periods (read from blackout_path) sit in the same interval index as the
+    # reservations, so every conflict check also finds them.
+    # lock makes check-then-write sequences atomic; events_lock is what
+    # readers of caches built from the change events hold (the same lock here).
+    remote = False
+
+    def __init__(self, paths, writer=None, blackout_path=None):
+        self.paths = dict(paths)
+        self.blackout_path = blackout_path
+        self.writer = writer or (lambda df, file_path: df.to_csv(file_path, index=False))
+        self.lock = threading.RLock()
+        self.events_lock = self.lock
+        self._records = {kind: {} for kind in self.paths}
+        self._columns = {kind: RESERVATION_COLUMNS + [ID_COLUMN] for kind in self.paths}
+        self._kind_of = {}
+        self._by_user = {}
+        self._intervals = {}
+        self._longest = {}
+        self._signatures = {}
+        self._blackouts = {}
+        # Kinds whose rows got legacy IDs that are not in their file yet
+        self._unsaved_ids = set()
+        self._listeners = []
+        self.version = 0
+        for kind in self.paths:
+            self._load(kind)
+        if blackout_path:
+            self._load_blackouts()
+
+    # File signature used to notice writes made outside of the store
+    def _signature(self, kind):
+        try:
+            stat = os.stat(self.blackout_path if kind == 'blackout' else self.paths[kind])
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _load(self, kind):
+        for rid, record in list(self._records[kind].items()):
+            self._unindex(rid, record)
+
+        file_path = self.paths[kind]
+        df = pd.read_csv(file_path, dtype=str) if os.path.exists(file_path) else pd.DataFrame()
+        for column in RESERVATION_COLUMNS + [ID_COLUMN]:
+            if column not in df.columns:
+                df[column] = None
+        self._columns[kind] = list(df.columns)
+        df = df.astype(object).where(df.notna(), None)
+
+        missing_ids = False
+        occurrences = {}
+        for row in df.to_dict('records'):
+            if not row[ID_COLUMN] or row[ID_COLUMN] in self._kind_of:
+                content = tuple(row[column] for column in RESERVATION_COLUMNS)
+                occurrences[content] = occurrences.get(content, 0) + 1
+                row[ID_COLUMN] = legacy_reservation_id(row, occurrences[content])
+                missing_ids = True
+            row['Start_Time'] = parse_time(row['Start_Time'])
+            row['End_Time'] = parse_time(row['End_Time'])
+            self._index(kind, row[ID_COLUMN], row)
+        self._signatures[kind] = self._signature(kind)
+
+        # The IDs handed out above are the same in every process, so loading
+        # never writes (nor backs up) anything: they reach the file with the
+        # next commit
+        if missing_ids:
+            self._unsaved_ids.add(kind)
+        else:
+            self._unsaved_ids.discard(kind)
+        self._notify('reload', None, None, None)
+
+    def _load_blackouts(self):
+        for bid, record in list(self._blackouts.items()):
+            self._unindex_interval((record['Room'], record['Equipments']), bid, record)
+        self._blackouts = {}
+        if os.path.exists(self.blackout_path):
+            df = pd.read_csv(self.blackout_path, dtype=str)
+            df = df.astype(object).where(df.notna(), None)
+            for record in df.to_dict('records'):
+                record['Start_Time'] = parse_time(record['Start_Time'])
+                record['End_Time'] = parse_time(record['End_Time'])
+                if all(isinstance(record[column], datetime.datetime) for column in ('Start_Time', 'End_Time')):
+                    self._blackouts[record['Blackout_ID']] = record
+                    self._index_interval((record['Room'], record['Equipments']), record['Blackout_ID'], record)
+        self._signatures['blackout'] = self._signature('blackout')
+        self._notify('reload', None, None, None)
+
+    # Reload any file that was rewritten behind our back (admin upload, git pull...)
+    def refresh(self):
+        with self.lock:
+            for kind in self.paths:
+                if self._signature(kind) != self._signatures.get(kind):
+                    self._load(kind)
+            if self.blackout_path and self._signature('blackout') != self._signatures.get('blackout'):
+                self._load_blackouts()
+
+    # callback(event, rid, record, previous) runs under the store lock after
+    # every change: 'add' (previous is None), 'cancel' (record is None),
+    # 'update', 'reload' when a file was re-read (no rid or records), and
+    # 'blackout' when a blackout is added (record) or removed (previous).
+    def subscribe(self, callback):
+        with self.lock:
+            self._listeners.append(callback)
+
+    def _notify(self, event, rid, record, previous):
+        self.version += 1
+        for callback in self._listeners:
+            callback(event, rid, record, previous)
+
+    def _index(self, kind, rid, record):
+        self._records[kind][rid] = record
+        self._kind_of[rid] = kind
+        if is_valid(record):
+            self._by_user.setdefault(record['Name'], {})[rid] = record
+            self._index_interval((record['Room'], record['Equipments']), rid, record)
+
+    def _index_interval(self, key, rid, record):
+        bisect.insort(self._intervals.setdefault(key, []), (record['Start_Time'], rid))
+        duration = record['End_Time'] - record['Start_Time']
+        if duration > self._longest.get(key, datetime.timedelta(0)):
+            self._longest[key] = duration
+
+    def _unindex(self, rid, record):
+        kind = self._kind_of.pop(rid, None)
+        if kind is not None:
+            self._records[kind].pop(rid, None)
+        user_records = self._by_user.get(record.get('Name'))
+        if user_records is not None:
+            user_records.pop(rid, None)
+            if not user_records:
+                del self._by_user[record['Name']]
+        if is_valid(record):
+            self._unindex_interval((record['Room'], record['Equipments']), rid, record)
+
+    def _unindex_interval(self, key, rid, record):
+        intervals = self._intervals.get(key)
+        if intervals is not None:
+            position = bisect.bisect_left(intervals, (record['Start_Time'], rid))
+            if position < len(intervals) and intervals[position][1] == rid:
+                del intervals[position]
+
+    # Reservation or blackout behind an ID of the interval index
+    def _interval_record(self, rid):
+        kind = self._kind_of.get(rid)
+        return self._blackouts[rid] if kind is None else self._records[kind][rid]
+
+    def _new_id(self):
+        rid = new_reservation_id()
+        while rid in self._kind_of or rid in self._blackouts:
+            rid = new_reservation_id()
+        return rid
+
+    def _write(self, kind):
+        rows = [{**record,
+                 'Start_Time': format_time(record['Start_Time']),
+                 'End_Time': format_time(record['End_Time'])}
+                for record in self._records[kind].values()]
+        df = pd.DataFrame(rows, columns=self._columns[kind])
+        self.writer(df, self.paths[kind])
+        self._signatures[kind] = self._signature(kind)
+        self._unsaved_ids.discard(kind)
+
+    # Replace the whole file of a reservation kind (admin upload) and reload it
+    def replace(self, kind, df):
+        if kind not in self.paths:
+            raise ValueError(f"Unknown reservation kind: {kind}")
+        with self.lock:
+            self.writer(df, self.paths[kind])
+            self._load(kind)
+
+    # Reservation (or blackout, as found by conflicts) with this ID, or None
+    def get(self, rid):
+        with self.lock:
+            self.refresh()
+            kind = self._kind_of.get(rid)
+            return self._blackouts.get(rid) if kind is None else self._records[kind][rid]
+
+    # Copy of every loaded reservation (valid or not) keyed by ID, as currently
+    # held in memory; safe to call from a subscriber callback
+    def records(self):
+        with self.lock:
+            return {rid: dict(record) for records in self._records.values() for rid, record in records.items()}
+
+    # Every valid reservation of a user, ordered by start time
+    def for_user(self, name):
+        with self.lock:
+            self.refresh()
+            return sorted(self._by_user.get(name, {}).values(), key=lambda record: record['Start_Time'])
+
+    # Every valid reservation of an equipment, ordered by start time
+    def for_equipment(self, room, equipment):
+        with self.lock:
+            self.refresh()
+            return [self._records[self._kind_of[rid]][rid] for _, rid in self._intervals.get((room, equipment), [])
+                    if rid in self._kind_of]
+
+    # Add a reservation and persist its file, returning the new reservation ID
+    def add(self, name, room, equipment, start_time, end_time):
+        return self.add_many([{
+            'Name': name,
+            'Room': room,
+            'Equipments': equipment,
+            'Start_Time': start_time,
+            'End_Time': end_time
+        }])[0]
+
+    # Add several reservations with a single write per touched file
+    def add_many(self, reservations):
+        return self.commit(adds=reservations)
+
+    # Remove a reservation and persist its file, returning the removed record
+    def cancel(self, rid):
+        with self.lock:
+            self.refresh()
+            kind = self._kind_of.get(rid)
+            if kind is None:
+                raise KeyError(f"Reservation {rid} not found")
+            record = self._records[kind][rid]
+            self.commit(cancels=[rid])
+            return record
+
+    # Cancel the IDs in cancels, apply updates ({ID: {field: value}}), add
+    # the reservations in adds and the blackout records in blackouts as one
+    # change: every touched file is written once, with all of it applied,
+    # before any listener hears of it. Returns the IDs of the added
+    # reservations.
+    def commit(self, adds=(), cancels=(), updates=None, blackouts=()):
+        updates = updates or {}
+        with self.lock:
+            self.refresh()
+            missing = [rid for rid in list(cancels) + list(updates) if rid not in self._kind_of]
+            if missing:
+                raise KeyError(f"Reservation {missing[0]} not found")
+            unknown = {field for changes in updates.values() for field in changes} - set(RESERVATION_COLUMNS)
+            if unknown:
+                raise ValueError(f"Cannot update field(s): {', '.join(sorted(unknown))}")
+            touched = set()
+            removed = []
+            for rid in cancels:
+                kind = self._kind_of[rid]
+                record = self._records[kind][rid]
+                self._unindex(rid, record)
+                touched.add(kind)
+                removed.append((rid, record))
+            # Take every updated reservation out first so they can swap places
+            changed = []
+            for rid, changes in updates.items():
+                old_record = self._records[self._kind_of[rid]][rid]
+                touched.add(self._kind_of[rid])
+                self._unindex(rid, old_record)
+                changed.append((rid, {**old_record, **changes}, old_record))
+            for rid, record, _ in changed:
+                kind = reservation_kind(record['Equipments'])
+                self._index(kind, rid, record)
+                touched.add(kind)
+            rids = []
+            for reservation in adds:
+                rid = self._new_id()
+                record = {column: reservation[column] for column in RESERVATION_COLUMNS}
+                record[ID_COLUMN] = rid
+                kind = reservation_kind(record['Equipments'])
+                self._index(kind, rid, record)
+                touched.add(kind)
+                rids.append(rid)
+            for record in blackouts:
+                self._blackouts[record['Blackout_ID']] = record
+                self._index_interval((record['Room'], record['Equipments']), record['Blackout_ID'], record)
+            for kind in touched | self._unsaved_ids:
+                self._write(kind)
+            if blackouts:
+                self._write_blackouts()
+            for record in blackouts:
+                self._notify('blackout', record['Blackout_ID'], record, None)
+            for rid, record in removed:
+                self._notify('cancel', rid, None, record)
+            for rid, record, old_record in changed:
+                self._notify('update', rid, record, old_record)
+            for rid in rids:
+                self._notify('add', rid, self._records[self._kind_of[rid]][rid], None)
+            return rids
+
+    # Change fields of a reservation, moving it to the other file when its
+    # equipment switches between PCR and non-PCR. Returns the updated record.
+    def update(self, rid, **changes):
+        with self.lock:
+            self.commit(updates={rid: changes})
+            return self._records[self._kind_of[rid]][rid]
+
+    # IDs of reservations and blackouts on this equipment (or its whole room)
+    # overlapping [start_time, end_time). Starts are kept sorted per
+    # equipment, and no interval there is longer than the longest one seen,
+    # so only starts in (start_time - longest, end_time) need to be looked at.
+    def conflicts(self, room, equipment, start_time, end_time):
+        with self.lock:
+            self.refresh()
+            return self._conflicts(room, equipment, start_time, end_time)
+
+    def _conflicts(self, room, equipment, start_time, end_time):
+        found = []
+        for key in ((room, equipment), (room, ROOM_WIDE)):
+            intervals = self._intervals.get(key)
+            if not intervals:
+                continue
+            low = bisect.bisect_right(intervals, (start_time - self._longest[key], chr(0x10FFFF)))
+            high = bisect.bisect_left(intervals, (end_time, ''))
+            for _, rid in intervals[low:high]:
+                if self._interval_record(rid)['End_Time'] > start_time:
+                    found.append(rid)
+        return found
+
+    # Check several (room, equipment, start, end) candidates in one pass under
+    # the lock, returning the conflicting IDs for each candidate in order
+    def find_conflicts(self, candidates):
+        with self.lock:
+            self.refresh()
+            return [self._conflicts(*candidate) for candidate in candidates]
+
+    # Valid reservations as one DataFrame with datetime columns, optionally
+    # only those of one room touching [start_time, end_time)
+    def frame(self, start_time=None, end_time=None, room=None):
+        with self.lock:
+            self.refresh()
+            rows = [record for records in self._records.values() for record in records.values()
+                    if is_valid(record)
+                    and (room is None or record['Room'] == room)
+                    and (start_time is None or record['End_Time'] > start_time)
+                    and (end_time is None or record['Start_Time'] < end_time)]
+        df = pd.DataFrame(rows, columns=RESERVATION_COLUMNS + [ID_COLUMN])
+        df['Start_Time'] = pd.to_datetime(df['Start_Time'])
+        df['End_Time'] = pd.to_datetime(df['End_Time'])
+        return df
+
+    # Reservations a user can still cancel: everything today plus future ones
+    # up to horizon_days ahead, ordered by start time. Only the user's own
+    # reservations are visited.
+    def upcoming_for_user(self, name, now=None, horizon_days=60):
+        now = now or datetime.datetime.now()
+        today = now.date()
+        last_day = today + datetime.timedelta(days=horizon_days)
+        with self.lock:
+            self.refresh()
+            upcoming = [
+                (rid, record) for rid, record in self._by_user.get(name, {}).items()
+                if record['Start_Time'].date() == today
+                or (today < record['Start_Time'].date() <= last_day and record['Start_Time'] > now)
+            ]
+        upcoming.sort(key=lambda item: item[1]['Start_Time'])
+        return upcoming
+
+    # Blackouts of a room (all rooms when None) touching [start_time, end_time), by start time
+    def blackouts(self, room=None, start_time=None, end_time=None):
+        with self.lock:
+            self.refresh()
+            return sorted((dict(record) for record in self._blackouts.values()
+                           if (room is None or record['Room'] == room)
+                           and (start_time is None or record['End_Time'] > start_time)
+                           and (end_time is None or record['Start_Time'] < end_time)),
+                          key=lambda record: record['Start_Time'])
+
+    # Reservations a blackout of [start_time, end_time) would collide with;
+    # equipment ROOM_WIDE (or None) covers every equipment of the room
+    def blackout_collisions(self, room, equipment, start_time, end_time):
+        with self.lock:
+            self.refresh()
+            return self._blackout_collisions(room, equipment or ROOM_WIDE, start_time, end_time)
+
+    def _blackout_collisions(self, room, equipment, start_time, end_time):
+        keys = [key for key in self._intervals if key[0] == room and key[1] != ROOM_WIDE] \
+            if equipment == ROOM_WIDE else [(room, equipment)]
+        found = [self._records[self._kind_of[rid]][rid] for key in keys
+                 for rid in self._conflicts(*key, start_time, end_time) if rid in self._kind_of]
+        return sorted({record[ID_COLUMN]: record for record in found}.values(), key=lambda record: record['Start_Time'])
+
+    # Close an equipment (or the whole room) for [start_time, end_time).
+    # Returns the new blackout ID and the reservations it collides with;
+    # with cancel_collisions they are cancelled in the same commit as the
+    # blackout is recorded. Needs a blackout_path.
+    def add_blackout(self, room, equipment, start_time, end_time, reason, cancel_collisions=False):
+        if not self.blackout_path:
+            raise ValueError("This store keeps no blackouts")
+        if start_time >= end_time:
+            raise ValueError("The start time must be before the end time.")
+        with self.lock:
+            self.refresh()
+            equipment = equipment or ROOM_WIDE
+            collisions = self._blackout_collisions(room, equipment, start_time, end_time)
+            bid = self._new_id()
+            record = {'Room': room, 'Equipments': equipment, 'Start_Time': start_time, 'End_Time': end_time,
+                      'Reason': reason, 'Blackout_ID': bid}
+            self.commit(cancels=[collision[ID_COLUMN] for collision in collisions] if cancel_collisions else (),
+                        blackouts=[record])
+            return bid, collisions
+
+    def remove_blackout(self, bid):
+        with self.lock:
+            self.refresh()
+            record = self._blackouts.pop(bid, None)
+            if record is None:
+                raise KeyError(f"Blackout {bid} not found")
+            self._unindex_interval((record['Room'], record['Equipments']), bid, record)
+            self._write_blackouts()
+            self._notify('blackout', bid, None, record)
+            return record
+
+    def _write_blackouts(self):
+        rows = [{**record, 'Start_Time': format_time(record['Start_Time']), 'End_Time': format_time(record['End_Time'])}
+                for record in self._blackouts.values()]
+        self.writer(pd.DataFrame(rows, columns=BLACKOUT_COLUMNS), self.blackout_path)
+        self._signatures['blackout'] = self._signature('blackout')
@@ -0,0 +1,205 @@
+import datetime
+import html
+
+import numpy as np
+import pandas as pd
+
+from reservation_store import ROOM_WIDE
+
+FULL_DAY = (datetime.time(0, 0), None)
+# Gantt "User" of the bars drawn for maintenance and blackout periods
+BLACKOUT_LABEL = 'Closed'
+
+
+# Daily operating window of an equipment: from its first to its last slot when
+# it has a slot template, otherwise the whole day (None stands for midnight)
+def operating_hours(policy, equipment):
+    template = policy.slot_template(None, equipment)
+    if not template:
+        return FULL_DAY
+    return min(start for start, _ in template), max(end for _, end in template)
+
+
+def day_bounds(days, hours):
+    opening, closing = hours
+    starts = np.array([datetime.datetime.combine(day, opening) for day in days], dtype='datetime64[s]')
+    if closing is None:
+        ends = np.array([datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(0, 0))
+                         for day in days], dtype='datetime64[s]')
+    else:
+        ends = np.array([datetime.datetime.combine(day, closing) for day in days], dtype='datetime64[s]')
+    return starts, ends
+
+
+# Busy fraction of every equipment of a room over the next days, as an
+# (equipment x day) DataFrame. All reservations touching the window are
+# clipped against every day bucket at once with NumPy broadcasting, and the
+# covered seconds are summed per equipment with np.add.at.
+def busy_fractions(reservations, equipments, first_day, days, hours):
+    dates = [first_day + datetime.timedelta(days=i) for i in range(days)]
+    covered = np.zeros((len(equipments), days))
+    capacity = np.zeros((len(equipments), days))
+    position = {equipment: i for i, equipment in enumerate(equipments)}
+
+    for equipment_hours in set(hours.values()):
+        rows = [position[equipment] for equipment in equipments if hours[equipment] == equipment_hours]
+        bucket_starts, bucket_ends = day_bounds(dates, equipment_hours)
+        capacity[rows] = (bucket_ends - bucket_starts).astype(np.float64)
+
+        group = reservations[reservations['Equipments'].map(hours) == equipment_hours]
+        if group.empty:
+            continue
+        starts = group['Start_Time'].to_numpy('datetime64[s]')[:, None]
+        ends = group['End_Time'].to_numpy('datetime64[s]')[:, None]
+        overlap = (np.minimum(ends, bucket_ends[None, :]) - np.maximum(starts, bucket_starts[None, :]))
+        overlap = np.clip(overlap.astype(np.float64), 0, None)
+        np.add.at(covered, group['Equipments'].map(position).to_numpy(), overlap)
+
+    fractions = np.clip(covered / capacity, 0, 1)
+    return pd.DataFrame(fractions, index=equipments, columns=[day.strftime('%a %d/%m') for day in dates])
+
+
+# Heatmap data of a room: enabled equipments x the next days
+def room_heatmap(store, policy, catalog, room, first_day, days):
+    equipments = [equipment for equipment, info in catalog[room].items() if info.get('enabled', False)]
+    hours = {equipment: operating_hours(policy, equipment) for equipment in equipments}
+    window_start = datetime.datetime.combine(first_day, datetime.time(0, 0))
+    reservations = store.frame(window_start, window_start + datetime.timedelta(days=days), room=room)
+    reservations = reservations[reservations['Equipments'].isin(equipments)]
+    return busy_fractions(reservations, equipments, first_day, days, hours)
+
+
+# Merge bars of the same equipment that touch or overlap, so a wide range
+# never ships more than max_bars bars to the browser. When that is still too
+# many, fall back to one bar per equipment and bucket of 1, 2, 4... days,
+# down to one bar per equipment.
+def merge_bars(bars, max_bars):
+    if len(bars) <= max_bars:
+        return bars
+    bars = bars.sort_values(['Task', 'Start'], ignore_index=True)
+    reach = bars.groupby('Task')['Finish'].cummax().groupby(bars['Task']).shift()
+    # The first bar of each equipment has no reach and always starts a group
+    bars['Group'] = (reach.isna() | (bars['Start'] > reach)).cumsum()
+    day_number = (bars['Start'] - bars['Start'].min().normalize()).dt.days
+    bucket_days = 1
+    while bars['Group'].nunique() > max_bars:
+        bars['Group'] = bars.groupby(['Task', day_number // bucket_days]).ngroup()
+        # A bucket spanning the whole range leaves one bar per equipment, as few as it gets
+        if bucket_days > day_number.max():
+            break
+        bucket_days *= 2
+    merged = bars.groupby('Group').agg(Task=('Task', 'first'), Start=('Start', 'min'), Finish=('Finish', 'max'),
+                                       User=('User', 'unique'))
+    merged['User'] = [users[0] if len(users) == 1 else f"{len(users)} users" for users in merged['User']]
+    return merged.reset_index(drop=True)
+
+
+# Gantt bars of a room from first_day to last_day (inclusive) in one pass:
+# the range is filtered once, every reservation is split into per-day pieces
+# clipped to its equipment's operating hours with the same broadcasting as
+# busy_fractions, and the result is merged down to at most max_bars bars.
+def room_timeline(store, policy, catalog, room, first_day, last_day, max_bars=500):
+    equipments = [equipment for equipment, info in catalog[room].items() if info.get('enabled', False)]
+    dates = [first_day + datetime.timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    window_start = datetime.datetime.combine(first_day, datetime.time(0, 0))
+    reservations = store.frame(window_start, window_start + datetime.timedelta(days=len(dates)), room=room)
+    reservations = reservations[reservations['Equipments'].isin(equipments)]
+    hours = {equipment: operating_hours(policy, equipment) for equipment in equipments}
+
+    pieces = []
+    for equipment_hours in set(hours.values()):
+        group = reservations[reservations['Equipments'].map(hours) == equipment_hours]
+        if group.empty:
+            continue
+        bucket_starts, bucket_ends = day_bounds(dates, equipment_hours)
+        starts = np.maximum(group['Start_Time'].to_numpy('datetime64[s]')[:, None], bucket_starts[None, :])
+        ends = np.minimum(group['End_Time'].to_numpy('datetime64[s]')[:, None], bucket_ends[None, :])
+        rows, days = np.nonzero(ends > starts)
+        pieces.append(pd.DataFrame({
+            'Task': group['Equipments'].to_numpy()[rows],
+            'Start': starts[rows, days],
+            'Finish': ends[rows, days],
+            'User': group['Name'].to_numpy()[rows]
+        }))
+
+    bars = pd.concat(pieces, ignore_index=True) if pieces else pd.DataFrame(columns=['Task', 'Start', 'Finish', 'User'])
+    bars = merge_bars(bars, max_bars)
+    bars = pd.concat([bars, blackout_bars(store, room, equipments, window_start,
+                                          window_start + datetime.timedelta(days=len(dates)))], ignore_index=True)
+
+    # Keep a row for idle equipments so every equipment shows up on the chart
+    idle = [equipment for equipment in equipments if equipment not in set(bars['Task'])]
+    window_end = np.datetime64(window_start + datetime.timedelta(days=len(dates)), 's')
+    bars = pd.concat([bars, pd.DataFrame({'Task': idle, 'Start': window_end, 'Finish': window_end, 'User': 'Available'})],
+                     ignore_index=True)
+    bars['Task'] = pd.Categorical(bars['Task'], categories=equipments)
+    return bars.sort_values('Task', ignore_index=True)
+
+
+# Bars of the blackouts of a room's equipments clipped to [window_start,
+# window_end); a room-wide blackout gets a bar on every equipment
+def blackout_bars(store, room, equipments, window_start, window_end):
+    rows = []
+    for blackout in store.blackouts(room, window_start, window_end):
+        covered = equipments if blackout['Equipments'] == ROOM_WIDE else [blackout['Equipments']]
+        for equipment in covered:
+            if equipment in equipments:
+                rows.append({'Task': equipment, 'Start': max(blackout['Start_Time'], window_start),
+                             'Finish': min(blackout['End_Time'], window_end), 'User': BLACKOUT_LABEL})
+    bars = pd.DataFrame(rows, columns=['Task', 'Start', 'Finish', 'User'])
+    bars['Start'] = pd.to_datetime(bars['Start'])
+    bars['Finish'] = pd.to_datetime(bars['Finish'])
+    return bars
+
+
+# Stylesheet of the lightweight timeline, sent once with the mobile styles
+LEAN_TIMELINE_CSS = """
+.lean-timeline { font-family: Arial; font-size: 14px; }
+.lean-timeline .lt-row { margin: 6px 0 10px 0; }
+.lean-timeline .lt-name { font-weight: bold; }
+.lean-timeline .lt-track { position: relative; height: 18px; background: #E8F5E9; border-radius: 3px; }
+.lean-timeline .lt-bar { position: absolute; top: 0; bottom: 0; background: #E53935; border-radius: 3px; }
+.lean-timeline .lt-closed { background: repeating-linear-gradient(45deg, #9E9E9E 0 4px, #BDBDBD 4px 8px); }
+.lean-timeline .lt-hours { display: flex; justify-content: space-between; color: gray; font-size: 11px; }
+.lean-timeline .lt-list { color: gray; font-size: 12px; }
+"""
+
+
+def format_hours(value):
+    return value.strftime('%H:%M') if value is not None else '24:00'
+
+
+# The day's reservations of a room as plain HTML: one track per equipment
+# covering its operating hours, with a bar per booking and a text list, so a
+# phone only downloads a few kilobytes and no charting library
+def day_timeline_html(store, policy, catalog, room, day):
+    bars = room_timeline(store, policy, catalog, room, day, day)
+    parts = ['<div class="lean-timeline">']
+    for equipment, equipment_bars in bars.groupby('Task', sort=True):
+        opening, closing = operating_hours(policy, equipment)
+        day_start = datetime.datetime.combine(day, opening)
+        day_starts, day_ends = day_bounds([day], (opening, closing))
+        length = (day_ends[0] - day_starts[0]).astype(np.float64)
+        booked = equipment_bars[equipment_bars['User'] != 'Available']
+
+        parts.append(f'<div class="lt-row"><div class="lt-name">{html.escape(str(equipment))}</div>'
+                     f'<div class="lt-track">')
+        for bar in booked.itertuples():
+            # Blackouts are not clipped to the operating hours like reservations
+            start = max(bar.Start, day_start)
+            finish = min(bar.Finish, day_start + datetime.timedelta(seconds=length))
+            if finish <= start:
+                continue
+            left = (start - day_start).total_seconds() / length * 100
+            width = (finish - start).total_seconds() / length * 100
+            css_class = 'lt-bar lt-closed' if bar.User == BLACKOUT_LABEL else 'lt-bar'
+            parts.append(f'<div class="{css_class}" style="left:{left:.1f}%;width:{width:.1f}%"></div>')
+        parts.append(f'</div><div class="lt-hours"><span>{format_hours(opening)}</span>'
+                     f'<span>{format_hours(closing)}</span></div>')
+        if not booked.empty:
+            parts.append('<div class="lt-list">' + ' &middot; '.join(
+                f"{bar.Start.strftime('%H:%M')}-{bar.Finish.strftime('%H:%M')} {html.escape(str(bar.User))}"
+                for bar in booked.itertuples()) + '</div>')
+        parts.append('</div>')
+    parts.append('</div>')
+    return ''.join(parts)
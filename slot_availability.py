@@ -0,0 +1,122 @@
+import datetime
+
+import pandas as pd
+
+from reservation_store import ROOM_WIDE
+
+
+def slot_label(number, start, end):
+    return f"Slot {number}: {start.strftime('%H:%M')}-{end.strftime('%H:%M')}"
+
+
+class SlotAvailability:
+    # Precomputed (equipment x day x slot) availability for every equipment
+    # with a slot template, over horizon_days from today. Each cell holds the
+    # ID of the reservation taking the slot, or None while it is free. Writes
+    # reported by the store only drop the cells of the touched equipment and
+    # days; they are rebuilt from the interval index the next time they are read.
+    def __init__(self, store, templates, horizon_days=60):
+        self.store = store
+        self.templates = dict(templates)
+        self.horizon_days = horizon_days
+        self._days = {key: {} for key in self.templates}
+        store.subscribe(self._on_change)
+        self.precompute()
+
+    # Fill every cell of the booking horizon
+    def precompute(self):
+        today = datetime.date.today()
+        with self.store.events_lock:
+            self.store.refresh()
+            self._drop_past_days(today)
+            self._fill([(key, today + datetime.timedelta(days=offset))
+                        for key in self.templates for offset in range(self.horizon_days + 1)])
+
+    # templates for every (room, equipment) of the catalog the policy gives slots to
+    @classmethod
+    def from_catalog(cls, store, policy, catalog, horizon_days=60):
+        templates = {}
+        for room, equipments in catalog.items():
+            for equipment in equipments:
+                template = policy.slot_template(None, equipment)
+                if template:
+                    templates[(room, equipment)] = template
+        return cls(store, templates, horizon_days)
+
+    def _on_change(self, event, rid, record, previous):
+        if event == 'reload':
+            for days in self._days.values():
+                days.clear()
+            return
+        for reservation in (record, previous):
+            if reservation is None:
+                continue
+            # A room-wide blackout touches every equipment of the room
+            keys = [key for key in self._days if key[0] == reservation['Room']
+                    and reservation['Equipments'] in (key[1], ROOM_WIDE)]
+            for key in keys:
+                day = reservation['Start_Time'].date()
+                while day <= reservation['End_Time'].date():
+                    self._days[key].pop(day, None)
+                    day += datetime.timedelta(days=1)
+
+    # Compute the missing cells of several (key, day) pairs with a single
+    # batched conflict query (one round trip when the store is remote)
+    def _fill(self, pairs):
+        missing = [(key, day) for key, day in pairs if day not in self._days[key]]
+        candidates = [(key[0], key[1], datetime.datetime.combine(day, start), datetime.datetime.combine(day, end))
+                      for key, day in missing for start, end in self.templates[key]]
+        found = iter(self.store.find_conflicts(candidates) if candidates else [])
+        for key, day in missing:
+            cells = []
+            for _ in self.templates[key]:
+                rids = next(found)
+                cells.append(rids[0] if rids else None)
+            self._days[key][day] = cells
+
+    def _cells(self, key, day):
+        self._fill([(key, day)])
+        return self._days[key][day]
+
+    def _drop_past_days(self, today):
+        for days in self._days.values():
+            for day in [day for day in days if day < today]:
+                del days[day]
+
+    # Slots of one equipment on one day as {label, start, end, rid} entries,
+    # rid being the reservation taking the slot or None
+    def slots(self, room, equipment, day):
+        key = (room, equipment)
+        if key not in self.templates:
+            return []
+        with self.store.events_lock:
+            self.store.refresh()
+            cells = self._cells(key, day)
+        return [{"label": slot_label(number, start, end), "start": start, "end": end, "rid": taken}
+                for number, ((start, end), taken) in enumerate(zip(self.templates[key], cells), start=1)]
+
+    # Free slots of one equipment on one day
+    def free_slots(self, room, equipment, day):
+        return [slot for slot in self.slots(room, equipment, day) if slot['rid'] is None]
+
+    # Taken slots of one equipment on one day, for the waitlist
+    def booked_slots(self, room, equipment, day):
+        return [slot for slot in self.slots(room, equipment, day) if slot['rid'] is not None]
+
+    # Free/busy grid of a room: one row per equipment slot, one column per day
+    def grid(self, room, first_day, days=7):
+        last_day = datetime.date.today() + datetime.timedelta(days=self.horizon_days)
+        dates = [first_day + datetime.timedelta(days=i) for i in range(days)
+                 if first_day + datetime.timedelta(days=i) <= last_day]
+        rows = {}
+        with self.store.events_lock:
+            self.store.refresh()
+            self._drop_past_days(datetime.date.today())
+            self._fill([(key, day) for key in self.templates if key[0] == room for day in dates])
+            for key, template in self.templates.items():
+                if key[0] != room:
+                    continue
+                for number, (start, end) in enumerate(template, start=1):
+                    rows[f"{key[1]} - {slot_label(number, start, end)}"] = [
+                        "Booked" if self._cells(key, day)[number - 1] else "Free" for day in dates]
+        return pd.DataFrame.from_dict(rows, orient='index', columns=[day.strftime('%a %d/%m') for day in dates])
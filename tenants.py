@@ -0,0 +1,85 @@
+import json
+import os
+
+DEFAULT_TENANT = 'default'
+
+
+class Tenant:
+    # One lab or department with its own catalog, reservation files, change
+    # log, announcement and backup repository, all kept under root. The
+    # default tenant's root is the app folder itself, so a single-lab setup
+    # keeps its files where they always were.
+    def __init__(self, tenant_id, name, root='.', backup_repo=None, service_url=None):
+        self.id = tenant_id
+        self.name = name
+        self.root = root
+        self.backup_repo = backup_repo
+        self.service_url = service_url
+
+    def path(self, file_name):
+        return file_name if self.root == '.' else os.path.join(self.root, file_name)
+
+    # Configuration (booking rules, holidays...) a tenant may override by
+    # putting its own copy under its root; otherwise the shared file is used
+    def config_path(self, file_name):
+        own = self.path(file_name)
+        return own if os.path.exists(own) else file_name
+
+    # Create the folder of a new tenant with an empty equipment catalog; the
+    # app creates its other files as usual
+    def init_root(self):
+        os.makedirs(self.root, exist_ok=True)
+        if not os.path.exists(self.path('equipment_details.json')):
+            with open(self.path('equipment_details.json'), 'w') as f:
+                f.write('{}')
+
+
+class Tenants:
+    # Tenants from tenants.json:
+    #   {"cross_tenant_admin": false,
+    #    "tenants": {"default": {"name": "Biotechnology Lab"},
+    #                "chem": {"name": "Chemistry", "root": "tenants/chem",
+    #                         "backup_repo": "Chem-Equipments_Reservation"}}}
+    # Users belong to the tenant named by the "tenant" field of their
+    # credentials (the default tenant when there is none). With
+    # cross_tenant_admin on, Admins may switch to any tenant.
+    def __init__(self, file_path):
+        settings = {}
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as f:
+                settings = json.load(f)
+        self.cross_tenant_admin = bool(settings.get('cross_tenant_admin', False))
+        self.tenants = {}
+        for tenant_id, info in settings.get('tenants', {}).items():
+            root = info.get('root', '.' if tenant_id == DEFAULT_TENANT else os.path.join('tenants', tenant_id))
+            self.tenants[tenant_id] = Tenant(tenant_id, info.get('name', tenant_id), root,
+                                             info.get('backup_repo'), info.get('service_url'))
+        if DEFAULT_TENANT not in self.tenants:
+            self.tenants[DEFAULT_TENANT] = Tenant(DEFAULT_TENANT, "Lab")
+
+    # Tenant with this ID, the default one when None; an unknown ID raises a
+    # KeyError rather than quietly showing another lab's reservations
+    def get(self, tenant_id=None):
+        if tenant_id is None:
+            return self.tenants[DEFAULT_TENANT]
+        if tenant_id not in self.tenants:
+            raise KeyError(f"Unknown lab: {tenant_id}")
+        return self.tenants[tenant_id]
+
+    def for_user(self, user):
+        return self.get(user.get('tenant', DEFAULT_TENANT))
+
+    # Tenant named by the --tenant option of a command line tool (the default
+    # one when not given), stopping the tool on an unknown ID
+    def from_args(self, parser, tenant_id):
+        try:
+            return self.get(tenant_id)
+        except KeyError:
+            parser.error(f"Unknown tenant: {tenant_id}")
+
+    # Tenants a user may work in: their own, or all of them for Admins when
+    # cross-tenant administration is on
+    def allowed(self, user):
+        if self.cross_tenant_admin and user.get('role') == 'Admins':
+            return list(self.tenants.values())
+        return [self.for_user(user)]
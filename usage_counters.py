@@ -0,0 +1,177 @@
+import fcntl
+import os
+import threading
+import uuid
+
+import pandas as pd
+
+COUNTER_COLUMNS = ['Equipment', 'Count', 'Total']
+
+
+# Service interval of an equipment: the first entry of service_intervals.json
+# whose "equipment" is a substring of its name. "every" uses trigger the
+# "action" message; with "reset": "auto" (the default) the count starts over
+# right away, with "manual" it keeps growing until an admin resets it.
+def interval_for(intervals, equipment):
+    for interval in intervals:
+        if interval['equipment'] in equipment:
+            return interval
+    return None
+
+
+# Counts of the old one-row-per-use autoclaves_count.csv
+def legacy_counts(file_path):
+    if not os.path.exists(file_path):
+        return {}
+    df = pd.read_csv(file_path)
+    if 'Counts' not in df.columns:
+        return {}
+    return df['Counts'].value_counts().to_dict()
+
+
+class UsageCounters:
+    # Per-equipment usage counters. Every increment or reset is one line
+    # appended to a journal under an exclusive file lock, after replaying the
+    # lines other processes appended since we last looked, so updates are
+    # atomic across threads and processes and cost one small write. Every
+    # compact_every lines the counters go to snapshot_path through writer
+    # (backed up like the other data files) and the journal starts over.
+    # backup(file_path), when given, is called on the journal after every
+    # change, so no recorded use is lost between two snapshots.
+    # seed gives the starting counts when there is no snapshot yet.
+    def __init__(self, path, snapshot_path, intervals, compact_every=500, writer=None, seed=None, backup=None):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.intervals = list(intervals)
+        self.compact_every = compact_every
+        self.writer = writer or (lambda df, file_path: df.to_csv(file_path, index=False))
+        self.backup = backup
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._totals = {}
+        self._generation = None
+        self._offset = 0
+        self._lines = 0
+        if not os.path.exists(snapshot_path) and seed:
+            self._counts = {equipment: int(count) for equipment, count in seed.items()}
+            self._totals = dict(self._counts)
+            self._write_snapshot()
+        with self._locked_journal() as f:
+            self._catch_up(f)
+
+    # The journal file, locked; retried when another process replaced it
+    # (compaction) while we were waiting for the lock
+    def _locked_journal(self):
+        while True:
+            f = open(self.path, 'a+')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            stat = os.fstat(f.fileno())
+            try:
+                current = os.stat(self.path)
+            except FileNotFoundError:
+                current = None
+            if current is not None and (current.st_dev, current.st_ino) == (stat.st_dev, stat.st_ino):
+                return f
+            f.close()
+
+    def _load_snapshot(self):
+        self._counts, self._totals = {}, {}
+        if os.path.exists(self.snapshot_path):
+            for row in pd.read_csv(self.snapshot_path).to_dict('records'):
+                self._counts[row['Equipment']] = int(row['Count'])
+                self._totals[row['Equipment']] = int(row['Total'])
+
+    def _write_snapshot(self):
+        df = pd.DataFrame([{'Equipment': equipment, 'Count': count, 'Total': self._totals.get(equipment, count)}
+                           for equipment, count in sorted(self._counts.items())], columns=COUNTER_COLUMNS)
+        self.writer(df, self.snapshot_path)
+
+    # Apply the journal lines appended since our last look. The first line
+    # of a journal names its generation; a new generation means another
+    # process compacted it, so we start over from the snapshot.
+    def _catch_up(self, f):
+        f.seek(0)
+        header = f.readline()
+        if not header:
+            header = f"gen\t0\t{uuid.uuid4().hex}\n"
+            f.write(header)
+            f.flush()
+        if header != self._generation:
+            self._load_snapshot()
+            self._generation = header
+            self._offset = len(header.encode('utf-8'))
+            self._lines = 0
+        f.seek(self._offset)
+        for line in iter(f.readline, ''):
+            operation, value, equipment = line.rstrip('\n').split('\t', 2)
+            self._apply(operation, equipment, int(value))
+            self._lines += 1
+        self._offset = f.tell()
+
+    def _apply(self, operation, equipment, value):
+        if operation == 'inc':
+            self._counts[equipment] = self._counts.get(equipment, 0) + value
+            self._totals[equipment] = self._totals.get(equipment, 0) + value
+        else:
+            self._counts[equipment] = value
+
+    def _record(self, f, operation, equipment, value):
+        f.seek(0, os.SEEK_END)
+        f.write(f"{operation}\t{value}\t{equipment}\n")
+        f.flush()
+        self._apply(operation, equipment, value)
+        self._lines += 1
+        self._offset = f.tell()
+
+    # Snapshot the counters and swap in a journal of a new generation
+    def _compact(self):
+        self._write_snapshot()
+        header = f"gen\t0\t{uuid.uuid4().hex}\n"
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(header)
+        os.replace(self.path + '.tmp', self.path)
+        self._generation = header
+        self._offset = len(header.encode('utf-8'))
+        self._lines = 0
+
+    def _change(self, operation, equipment, value):
+        with self._lock, self._locked_journal() as f:
+            self._catch_up(f)
+            self._record(f, operation, equipment, value)
+            count = self._counts[equipment]
+            interval = interval_for(self.intervals, equipment)
+            action = None
+            if operation == 'inc' and interval and count >= interval['every']:
+                action = interval['action']
+                if interval.get('reset', 'auto') == 'auto':
+                    self._record(f, 'set', equipment, 0)
+            if self._lines >= self.compact_every:
+                self._compact()
+        # Outside the lock: a slow backup must not hold up the other processes
+        if self.backup is not None:
+            self.backup(self.path)
+        return count, action
+
+    # Count one use; returns the count including it and the interval's
+    # action message when this use reaches the threshold (else None)
+    def increment(self, equipment, by=1):
+        return self._change('inc', equipment, by)
+
+    # Start the count over, e.g. after the equipment was serviced
+    def reset(self, equipment, value=0):
+        return self._change('set', equipment, value)[0]
+
+    def interval_for(self, equipment):
+        return interval_for(self.intervals, equipment)
+
+    # Counters as a table: uses since the last reset, threshold, and uses ever
+    def table(self):
+        with self._lock, self._locked_journal() as f:
+            self._catch_up(f)
+            counts, totals = dict(self._counts), dict(self._totals)
+        rows = []
+        for equipment, count in sorted(counts.items()):
+            interval = interval_for(self.intervals, equipment)
+            rows.append({'Equipment': equipment, 'Count': count, 'Every': interval['every'] if interval else None,
+                         'Total': totals.get(equipment, count)})
+        return pd.DataFrame(rows, columns=['Equipment', 'Count', 'Every', 'Total'])
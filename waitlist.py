@@ -0,0 +1,160 @@
+import datetime
+import heapq
+import os
+import uuid
+
+import pandas as pd
+
+from reservation_store import format_time, parse_time
+
+WAITLIST_COLUMNS = ['Waitlist_ID', 'Name', 'Role', 'Room', 'Equipments', 'Start_Time', 'End_Time', 'Joined_At',
+                    'Priority', 'Status', 'Reservation_ID', 'Notified']
+ORDERINGS = ('fifo', 'fair_share')
+
+
+class Waitlist:
+    # Users waiting for a taken time on an equipment. Each (room, equipment)
+    # has a heap of (priority, joined_at, waitlist ID): with 'fifo' ordering
+    # the priority is 0 for everyone, so the earliest to join goes first;
+    # with 'fair_share' it is the number of upcoming reservations the user
+    # held when joining, so people holding fewer slots go first.
+    # cancel_and_promote() cancels a reservation and books the first eligible
+    # waiter in its place in the same store write. Entries go from 'waiting'
+    # to 'promoted', 'expired' (the time passed) or 'left'.
+    def __init__(self, store, policy, path, ordering='fifo', writer=None):
+        if ordering not in ORDERINGS:
+            raise ValueError(f"Unknown waitlist ordering: {ordering}")
+        self.store = store
+        self.policy = policy
+        self.path = path
+        self.ordering = ordering
+        self.writer = writer or (lambda df, file_path: df.to_csv(file_path, index=False))
+        self._entries = {}
+        self._queues = {}
+        self._load()
+
+    def _load(self):
+        df = pd.read_csv(self.path, dtype=str) if os.path.exists(self.path) else pd.DataFrame()
+        for column in WAITLIST_COLUMNS:
+            if column not in df.columns:
+                df[column] = None
+        df = df.astype(object).where(df.notna(), None)
+        for entry in df[WAITLIST_COLUMNS].to_dict('records'):
+            for column in ('Start_Time', 'End_Time', 'Joined_At'):
+                entry[column] = parse_time(entry[column])
+            entry['Priority'] = int(entry['Priority'] or 0)
+            self._entries[entry['Waitlist_ID']] = entry
+            if entry['Status'] == 'waiting':
+                self._push(entry)
+
+    def _push(self, entry):
+        heapq.heappush(self._queues.setdefault((entry['Room'], entry['Equipments']), []),
+                       (entry['Priority'], entry['Joined_At'], entry['Waitlist_ID']))
+
+    def _save(self):
+        rows = [{**entry, **{column: format_time(entry[column]) for column in ('Start_Time', 'End_Time', 'Joined_At')}}
+                for entry in self._entries.values()]
+        self.writer(pd.DataFrame(rows, columns=WAITLIST_COLUMNS), self.path)
+
+    # Waiting entries of an equipment in queue order. Entries that left the
+    # queue are dropped from the top of the heap as they are met.
+    def _queue(self, room, equipment):
+        heap = self._queues.get((room, equipment), [])
+        while heap and self._entries[heap[0][2]]['Status'] != 'waiting':
+            heapq.heappop(heap)
+        return [self._entries[wid] for _, _, wid in sorted(heap) if self._entries[wid]['Status'] == 'waiting']
+
+    # Put a user in the queue for [start_time, end_time) on an equipment,
+    # returning the waitlist ID. Every booking rule but no_overlap must
+    # already hold, so that a promotion only waits for the time to free up.
+    def join(self, name, role, room, equipment, start_time, end_time, now=None):
+        now = now or datetime.datetime.now()
+        candidate = {'Name': name, 'Room': room, 'Equipments': equipment,
+                     'Start_Time': start_time, 'End_Time': end_time}
+        with self.store.lock:
+            violations = self.policy.check(self.store, role, [candidate], now, skip={'no_overlap'})[0]
+            if violations:
+                raise ValueError(' '.join(violations))
+            for entry in self._queue(room, equipment):
+                if entry['Name'] == name and entry['Start_Time'] == start_time and entry['End_Time'] == end_time:
+                    raise ValueError("You are already on the waitlist for this time.")
+            if any(self.store.get(rid).get('Name') == name
+                   for rid in self.store.conflicts(room, equipment, start_time, end_time)):
+                raise ValueError("You already hold a reservation at this time.")
+            priority = len(self.store.upcoming_for_user(name, now)) if self.ordering == 'fair_share' else 0
+            wid = uuid.uuid4().hex[:12]
+            self._entries[wid] = {**candidate, 'Waitlist_ID': wid, 'Role': role, 'Joined_At': now,
+                                  'Priority': priority, 'Status': 'waiting', 'Reservation_ID': None,
+                                  'Notified': None}
+            self._push(self._entries[wid])
+            self._save()
+            return wid
+
+    # Leave the queue; only waiting entries of that user can be removed
+    def leave(self, wid, name):
+        with self.store.lock:
+            entry = self._entries.get(wid)
+            if entry is None or entry['Name'] != name or entry['Status'] != 'waiting':
+                raise KeyError(f"Waitlist entry {wid} not found")
+            entry['Status'] = 'left'
+            self._save()
+
+    # Cancel a reservation and hand its time to the first waiter of the
+    # equipment who now fits: the waiter's time overlaps the freed one,
+    # nothing else holds it and the booking rules still pass for them.
+    # Both changes go to the store as one commit. Returns the cancelled
+    # record and the promoted waitlist entry (or None).
+    def cancel_and_promote(self, rid, now=None):
+        now = now or datetime.datetime.now()
+        with self.store.lock:
+            record = self.store.get(rid)
+            if record is None:
+                raise KeyError(f"Reservation {rid} not found")
+            promoted = None
+            expired = False
+            for entry in self._queue(record['Room'], record['Equipments']):
+                if entry['Start_Time'] <= now:
+                    entry['Status'] = 'expired'
+                    expired = True
+                    continue
+                if entry['Start_Time'] >= record['End_Time'] or entry['End_Time'] <= record['Start_Time']:
+                    continue
+                if [other for other in self.store.conflicts(entry['Room'], entry['Equipments'], entry['Start_Time'],
+                                                            entry['End_Time']) if other != rid]:
+                    continue
+                candidate = {column: entry[column] for column in ('Name', 'Room', 'Equipments', 'Start_Time',
+                                                                  'End_Time')}
+                if self.policy.check(self.store, entry['Role'], [candidate], now, skip={'no_overlap'})[0]:
+                    continue
+                promoted = entry
+                break
+            if promoted is None:
+                self.store.cancel(rid)
+            else:
+                promoted['Reservation_ID'] = self.store.commit(adds=[candidate], cancels=[rid])[0]
+                promoted['Status'] = 'promoted'
+            if promoted is not None or expired:
+                self._save()
+            return record, promoted
+
+    # Waitlist entries of a user that are still waiting, or promoted and not shown yet
+    def for_user(self, name):
+        with self.store.lock:
+            return sorted((dict(entry) for entry in self._entries.values() if entry['Name'] == name
+                           and (entry['Status'] == 'waiting'
+                                or (entry['Status'] == 'promoted' and not entry['Notified']))),
+                          key=lambda entry: entry['Start_Time'])
+
+    # Remember that the user saw these promotions; the file is only written
+    # (and backed up) when one of them was not marked yet
+    def mark_notified(self, wids, now=None):
+        now = now or datetime.datetime.now()
+        with self.store.lock:
+            changed = False
+            for wid in wids:
+                entry = self._entries.get(wid)
+                if entry is not None and not entry['Notified']:
+                    entry['Notified'] = format_time(now)
+                    changed = True
+            if changed:
+                self._save()